@@ -1,3 +1,5 @@
+import os
+import sys
 import urllib.parse
 
 from pyramid.authentication import AuthTktAuthenticationPolicy
@@ -8,51 +10,66 @@ from pyramid.httpexceptions import HTTPFound
 from pyramid.httpexceptions import HTTPNotFound
 from pyramid.security import forget
 from pyramid.security import remember
+from pyramid.settings import asbool
 from pyramid.view import forbidden_view_config
 from pyramid.view import view_config
 
+from precompile import precompile_templates
+from store import open_store
+
 ### DEFINE MODEL
 class User(object):
+    # a worker may hold a great many users and pages, so neither carries a
+    # __dict__ and the names they repeat are interned to be shared
+    __slots__ = ('login', 'password', 'groups')
+
     def __init__(self, login, password, groups=None):
-        self.login = login
+        self.login = sys.intern(login)
         self.password = password
-        self.groups = groups or []
+        self.groups = tuple(sys.intern(g) for g in groups or ())
 
     def check_password(self, passwd):
         return self.password == passwd
 
 class Page(object):
+    __slots__ = ('title', 'uri', 'body', 'owner')
+
     def __init__(self, title, uri, body, owner):
         self.title = title
         self.uri = uri
         self.body = body
-        self.owner = owner
+        self.owner = sys.intern(owner)
 
 def websafe_uri(txt):
     uri = txt.replace(' ', '-')
     return urllib.parse.quote(uri)
 
 ### INITIALIZE MODEL
-USERS = {}
-PAGES = {}
-
 def _make_demo_user(login, **kw):
     kw.setdefault('password', login)
-    USERS[login] = User(login, **kw)
-    return USERS[login]
-
-_make_demo_user('luser')
-_make_demo_user('editor', groups=['editors'])
-_make_demo_user('admin', groups=['admin'])
-
-def _make_demo_page(title, **kw):
-    uri = kw.setdefault('uri', websafe_uri(title))
-    PAGES[uri] = Page(title, **kw)
-    return PAGES[uri]
-
-_make_demo_page('hello', owner='luser',
-                body='''
-<h3>Hello World!</h3><p>I'm the body text</p>''')
+    return User(login, **kw)
+
+def _make_demo_page(store, title, **kw):
+    kw.setdefault('uri', websafe_uri(title))
+    page = Page(title, **kw)
+    store.pages.add(page)
+    return page
+
+def _init_demo_data(store):
+    # every process sharing a store gets here, the store adds the data
+    # only once
+    store.seed([
+        _make_demo_user('luser'),
+        _make_demo_user('editor', groups=['editors']),
+        _make_demo_user('admin', groups=['admin']),
+    ], [
+        Page('hello', uri=websafe_uri('hello'), owner='luser',
+             body='''
+<h3>Hello World!</h3><p>I'm the body text</p>'''),
+    ])
+
+def get_store(request):
+    return request.registry.store
 
 ### DEFINE VIEWS
 @forbidden_view_config()
@@ -70,11 +87,11 @@ def forbidden_view(request):
 )
 def home_view(request):
     login = request.authenticated_userid
-    user = USERS.get(login)
+    user = request.store.users.get(login)
 
     return {
         'user': user,
-        'user_pages': [p for (t, p) in PAGES.items() if p.owner == login],
+        'user_pages': request.store.pages.by_owner(login),
     }
 
 @view_config(
@@ -89,7 +106,7 @@ def login_view(request):
         login = request.POST.get('login', '')
         passwd = request.POST.get('passwd', '')
 
-        user = USERS.get(login, None)
+        user = request.store.users.get(login)
         if user and user.check_password(passwd):
             headers = remember(request, login)
             return HTTPFound(location=next, headers=headers)
@@ -99,7 +116,7 @@ def login_view(request):
         'login': login,
         'next': next,
         'failed_attempt': did_fail,
-        'users': USERS,
+        'users': request.store.users.items(),
     }
 
 @view_config(
@@ -116,7 +133,7 @@ def logout_view(request):
 )
 def users_view(request):
     return {
-        'users': sorted(USERS.keys()),
+        'users': request.store.users.logins(),
     }
 
 @view_config(
@@ -125,11 +142,11 @@ def users_view(request):
 )
 def user_view(request):
     login = request.matchdict['login']
-    user = USERS.get(login)
+    user = request.store.users.get(login)
     if not user:
         raise HTTPNotFound()
 
-    pages = [p for (t, p) in PAGES.items() if p.owner == login]
+    pages = request.store.pages.by_owner(login)
 
     return {
         'user': user,
@@ -142,7 +159,7 @@ def user_view(request):
 )
 def pages_view(request):
     return {
-        'pages': PAGES.values(),
+        'pages': request.store.pages.all(),
     }
 
 @view_config(
@@ -151,7 +168,7 @@ def pages_view(request):
 )
 def page_view(request):
     uri = request.matchdict['title']
-    page = PAGES.get(uri)
+    page = request.store.pages.get(uri)
     if not page:
         raise HTTPNotFound()
 
@@ -199,7 +216,8 @@ def create_page_view(request):
         errors += v['errors']
 
         if not errors:
-            page = _make_demo_page(title, owner=owner, body=body)
+            page = _make_demo_page(request.store, title,
+                                   owner=owner, body=body)
             url = request.route_url('page', title=page.uri)
             return HTTPFound(location=url)
 
@@ -216,7 +234,7 @@ def create_page_view(request):
 )
 def edit_page_view(request):
     uri = request.matchdict['title']
-    page = PAGES.get(uri)
+    page = request.store.pages.get(uri)
     if not page:
         raise HTTPNotFound()
 
@@ -233,11 +251,10 @@ def edit_page_view(request):
         errors += v['errors']
 
         if not errors:
-            del PAGES[uri]
             page.title = title
             page.body = body
             page.uri = websafe_uri(title)
-            PAGES[page.uri] = page
+            request.store.pages.move(uri, page)
             url = request.route_url('page', title=page.uri)
             return HTTPFound(location=url)
 
@@ -252,6 +269,11 @@ def edit_page_view(request):
 def main(global_settings, **settings):
     config = Configurator(settings=settings)
 
+    store = open_store(settings.get('store.url', 'memory://'), User, Page)
+    _init_demo_data(store)
+    config.registry.store = store
+    config.add_request_method(get_store, 'store', reify=True)
+
     authn_policy = AuthTktAuthenticationPolicy(
         settings['auth.secret'],
     )
@@ -274,12 +296,17 @@ def main(global_settings, **settings):
 
     config.include('pyramid_mako')
     config.scan(__name__)
-    return config.make_wsgi_app()
+    app = config.make_wsgi_app()
+
+    if asbool(settings.get('templates.precompile', False)):
+        precompile_templates(app.registry)
+    return app
 
 ### SIMPLE STARTUP
 if __name__ == '__main__':
     settings = {
         'auth.secret': 'seekrit',
+        'store.url': os.environ.get('STORE_URL', 'memory://'),
         'mako.directories': '%s:templates' % __name__,
     }
     app = main({}, **settings)
@@ -0,0 +1,412 @@
+""" Storage for the demo's ``User`` and ``Page`` objects.
+
+The views never touch a backend directly. They go through a store which
+exposes a ``users`` and a ``pages`` repository. Two backends are provided:
+
+- ``memory://`` keeps everything in dictionaries in the current process.
+  This is the default and is what the demo has always done.
+
+- ``sqlite:///path/to/file.db`` keeps everything in a SQLite database
+  which may be shared by many processes serving the same application.
+
+"""
+import bisect
+import json
+import os
+import sqlite3
+import threading
+
+### MEMORY BACKEND
+class MemoryUserRepository(object):
+    def __init__(self, user_factory):
+        self._make = user_factory
+        self._users = {}
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """ Call ``callback(login)`` whenever a user is added or changed."""
+        self._subscribers.append(callback)
+
+    def _notify(self, login):
+        for callback in self._subscribers:
+            callback(login)
+
+    def __getitem__(self, login):
+        return self._users[login]
+
+    def __contains__(self, login):
+        return login in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, login, default=None):
+        return self._users.get(login, default)
+
+    def items(self):
+        return sorted(self._users.items())
+
+    def logins(self):
+        return sorted(self._users)
+
+    def add(self, user):
+        self._users[user.login] = user
+        self._notify(user.login)
+
+    def set_groups(self, login, groups):
+        # replace the user rather than changing an object readers may hold
+        user = self._users[login]
+        self._users[login] = self._make(
+            user.login, password=user.password, groups=groups)
+        self._notify(login)
+
+    def add_many(self, users):
+        for user in users:
+            self.add(user)
+
+class MemoryPageRepository(object):
+    """ A mapping of uri -> page that also indexes pages by their owner.
+
+    Pages must be added with ``add`` and renamed with ``move`` so that
+    the owner index stays in sync with the mapping.
+    """
+    def __init__(self):
+        self._pages = {}
+        self._by_owner = {}
+        self._uris = []
+
+    def __getitem__(self, uri):
+        return self._pages[uri]
+
+    def __contains__(self, uri):
+        return uri in self._pages
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, uri, default=None):
+        return self._pages.get(uri, default)
+
+    def all(self):
+        return [self._pages[uri] for uri in self._uris]
+
+    def listing(self, after=None, limit=None):
+        """ Return up to ``limit`` pages ordered by uri, starting after the
+        uri ``after``."""
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(self._uris, after)
+        stop = None if limit is None else start + limit
+        return [self._pages[uri] for uri in self._uris[start:stop]]
+
+    def by_owner(self, owner):
+        return list(self._by_owner.get(owner, {}).values())
+
+    def add(self, page):
+        old = self._pages.get(page.uri)
+        if old is not None:
+            self._unindex(old, page.uri)
+        else:
+            bisect.insort(self._uris, page.uri)
+        self._pages[page.uri] = page
+        self._by_owner.setdefault(page.owner, {})[page.uri] = page
+
+    def add_many(self, pages):
+        for page in pages:
+            self.add(page)
+
+    def move(self, old_uri, page):
+        old = self._pages.pop(old_uri)
+        self._unindex(old, old_uri)
+        del self._uris[bisect.bisect_left(self._uris, old_uri)]
+        self.add(page)
+
+    def _unindex(self, page, uri):
+        owned = self._by_owner.get(page.owner)
+        if owned is not None:
+            owned.pop(uri, None)
+            if not owned:
+                del self._by_owner[page.owner]
+
+class MemoryStore(object):
+    def __init__(self, user_factory, page_factory):
+        self.users = MemoryUserRepository(user_factory)
+        self.pages = MemoryPageRepository()
+
+    def seed(self, users, pages):
+        """ Add ``users`` and ``pages`` unless the store has users already.
+
+        Several processes sharing the store may all call this when they
+        start; the data is only added once. Returns whether it was added.
+        """
+        if len(self.users):
+            return False
+        self.users.add_many(users)
+        self.pages.add_many(pages)
+        return True
+
+    def close(self):
+        pass
+
+### SQLITE BACKEND
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    login TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    groups TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    uri TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    owner TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_owner ON pages (owner, uri);
+'''
+
+class ConnectionPool(object):
+    """ Hand out one SQLite connection per thread.
+
+    Connections are reopened after a fork so that worker processes never
+    share a connection with their parent.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # created in another thread which still owns it
+                pass
+        self._local = threading.local()
+
+class SQLiteUserRepository(object):
+    def __init__(self, pool, user_factory):
+        self._pool = pool
+        self._make = user_factory
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """ Call ``callback(login)`` whenever a user is added or changed.
+
+        Only changes made by this process are reported.
+        """
+        self._subscribers.append(callback)
+
+    def _notify(self, login):
+        for callback in self._subscribers:
+            callback(login)
+
+    def _load(self, row):
+        login, password, groups = row
+        return self._make(login, password=password, groups=json.loads(groups))
+
+    def __getitem__(self, login):
+        user = self.get(login)
+        if user is None:
+            raise KeyError(login)
+        return user
+
+    def __contains__(self, login):
+        return self.get(login) is not None
+
+    def __len__(self):
+        conn = self._pool.connection()
+        return conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def get(self, login, default=None):
+        conn = self._pool.connection()
+        row = conn.execute(
+            'SELECT login, password, groups FROM users WHERE login = ?',
+            (login,),
+        ).fetchone()
+        if row is None:
+            return default
+        return self._load(row)
+
+    def items(self):
+        conn = self._pool.connection()
+        rows = conn.execute(
+            'SELECT login, password, groups FROM users ORDER BY login')
+        return [(row[0], self._load(row)) for row in rows]
+
+    def logins(self):
+        conn = self._pool.connection()
+        rows = conn.execute('SELECT login FROM users ORDER BY login')
+        return [row[0] for row in rows]
+
+    def add(self, user):
+        conn = self._pool.connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO users (login, password, groups) '
+                'VALUES (?, ?, ?)',
+                (user.login, user.password, json.dumps(user.groups)),
+            )
+        self._notify(user.login)
+
+    def add_many(self, users):
+        users = list(users)
+        conn = self._pool.connection()
+        with conn:
+            self._insert_many(conn, users)
+        for user in users:
+            self._notify(user.login)
+
+    def _insert_many(self, conn, users):
+        conn.executemany(
+            'INSERT OR REPLACE INTO users (login, password, groups) '
+            'VALUES (?, ?, ?)',
+            [(u.login, u.password, json.dumps(u.groups)) for u in users],
+        )
+
+    def set_groups(self, login, groups):
+        conn = self._pool.connection()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE users SET groups = ? WHERE login = ?',
+                (json.dumps(list(groups)), login),
+            )
+        if not cursor.rowcount:
+            raise KeyError(login)
+        self._notify(login)
+
+class SQLitePageRepository(object):
+    def __init__(self, pool, page_factory):
+        self._pool = pool
+        self._make = page_factory
+
+    def _load(self, row):
+        uri, title, body, owner = row
+        return self._make(title, uri=uri, body=body, owner=owner)
+
+    def _query(self, where='', params=()):
+        conn = self._pool.connection()
+        return conn.execute(
+            'SELECT uri, title, body, owner FROM pages ' + where, params)
+
+    def __getitem__(self, uri):
+        page = self.get(uri)
+        if page is None:
+            raise KeyError(uri)
+        return page
+
+    def __contains__(self, uri):
+        return self.get(uri) is not None
+
+    def __len__(self):
+        conn = self._pool.connection()
+        return conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def get(self, uri, default=None):
+        row = self._query('WHERE uri = ?', (uri,)).fetchone()
+        if row is None:
+            return default
+        return self._load(row)
+
+    def all(self):
+        return [self._load(row) for row in self._query('ORDER BY uri')]
+
+    def listing(self, after=None, limit=None):
+        where, params = 'ORDER BY uri', ()
+        if after is not None:
+            where, params = 'WHERE uri > ? ORDER BY uri', (after,)
+        if limit is not None:
+            where, params = where + ' LIMIT ?', params + (limit,)
+        return [self._load(row) for row in self._query(where, params)]
+
+    def by_owner(self, owner):
+        rows = self._query('WHERE owner = ? ORDER BY uri', (owner,))
+        return [self._load(row) for row in rows]
+
+    def add(self, page):
+        conn = self._pool.connection()
+        with conn:
+            self._insert(conn, page)
+
+    def add_many(self, pages):
+        conn = self._pool.connection()
+        with conn:
+            self._insert_many(conn, pages)
+
+    def _insert_many(self, conn, pages):
+        conn.executemany(
+            'INSERT OR REPLACE INTO pages (uri, title, body, owner) '
+            'VALUES (?, ?, ?, ?)',
+            [(p.uri, p.title, p.body, p.owner) for p in pages],
+        )
+
+    def move(self, old_uri, page):
+        conn = self._pool.connection()
+        with conn:
+            conn.execute('DELETE FROM pages WHERE uri = ?', (old_uri,))
+            self._insert(conn, page)
+
+    def _insert(self, conn, page):
+        conn.execute(
+            'INSERT OR REPLACE INTO pages (uri, title, body, owner) '
+            'VALUES (?, ?, ?, ?)',
+            (page.uri, page.title, page.body, page.owner),
+        )
+
+class SQLiteStore(object):
+    def __init__(self, path, user_factory, page_factory):
+        self.pool = ConnectionPool(path)
+        self.pool.connection().executescript(SCHEMA)
+        self.users = SQLiteUserRepository(self.pool, user_factory)
+        self.pages = SQLitePageRepository(self.pool, page_factory)
+
+    def seed(self, users, pages):
+        """ Add ``users`` and ``pages`` unless the store has users already.
+
+        Several processes sharing the store may all call this when they
+        start; the data is only added once. Returns whether it was added.
+        """
+        users = list(users)
+        conn = self.pool.connection()
+        with conn:
+            # taking the write lock first makes the check and the inserts
+            # one step for the other processes
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+                return False
+            self.users._insert_many(conn, users)
+            self.pages._insert_many(conn, pages)
+        for user in users:
+            self.users._notify(user.login)
+        return True
+
+    def close(self):
+        self.pool.close()
+
+def open_store(url, user_factory, page_factory):
+    """ Open the store described by ``url``.
+
+    ``user_factory`` and ``page_factory`` are used by backends which need
+    to rebuild model objects from their stored representation.
+    """
+    if url == 'memory://':
+        return MemoryStore(user_factory, page_factory)
+    if url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        return SQLiteStore(path, user_factory, page_factory)
+    raise ValueError('unsupported store url: %r' % (url,))
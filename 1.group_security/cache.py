@@ -0,0 +1,78 @@
+""" Caching helpers shared by the demo's authentication machinery. """
+from collections import OrderedDict
+import threading
+import time
+
+_MISSING = object()
+
+class LRUCache(object):
+    """ A thread-safe least-recently-used cache.
+
+    Entries older than ``ttl`` seconds are treated as missing. A ``ttl`` of
+    ``None`` keeps entries until they are evicted or invalidated.
+    """
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires = entry
+            if expires is not None and expires <= self._clock():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = None
+        if self.ttl is not None:
+            expires = self._clock() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+def memoize_principals(groupfinder, cache=None):
+    """ Wrap a ``groupfinder`` so it runs at most once per request.
+
+    The authentication policy calls its callback every time the effective
+    principals are needed, which may be several times per request. The
+    result is remembered on the request and, if ``cache`` is an
+    :class:`LRUCache`, shared between requests keyed by userid.
+    """
+    def cached_groupfinder(userid, request):
+        try:
+            memo = request._principals_memo
+        except AttributeError:
+            memo = request._principals_memo = {}
+
+        principals = memo.get(userid, _MISSING)
+        if principals is _MISSING:
+            if cache is not None:
+                principals = cache.get(userid, _MISSING)
+            if principals is _MISSING:
+                principals = groupfinder(userid, request)
+                if cache is not None:
+                    cache.set(userid, principals)
+            memo[userid] = principals
+        return principals
+    return cached_groupfinder
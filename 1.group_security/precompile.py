@@ -0,0 +1,37 @@
+""" Compile the demo's Mako templates before the first request.
+
+pyramid_mako compiles a template the first time it is rendered, so the
+first requests after a start are slow. ``precompile_templates`` compiles
+every template found in the ``mako.directories`` up front. When
+``mako.module_directory`` is set Mako also writes the compiled modules to
+that directory, and other processes using the same directory load them
+instead of compiling the templates again.
+
+The demos have templates with the same names, so each demo needs a
+module directory of its own.
+"""
+import os
+
+from pyramid.interfaces import IRendererFactory
+
+def template_names(directories, extension='.mako'):
+    """ Yield the lookup names of the templates below ``directories``."""
+    for directory in directories:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(extension):
+                    path = os.path.join(dirpath, filename)
+                    name = os.path.relpath(path, directory)
+                    yield name.replace(os.sep, '/')
+
+def precompile_templates(registry, extension='.mako'):
+    """ Compile every template of the committed ``registry``.
+
+    Returns the names of the compiled templates.
+    """
+    lookup = registry.getUtility(IRendererFactory, name=extension).lookup
+    names = list(template_names(lookup.directories, extension))
+    for name in names:
+        lookup.get_template(name)
+    return names
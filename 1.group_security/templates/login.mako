@@ -17,6 +17,6 @@
 </form>
 
 <h3>Valid login / password combinations:</h3>
-% for k, v in users.items():
+% for k, v in users:
 <p>${ k } / ${ v.password }</p>
 % endfor
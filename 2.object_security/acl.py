@@ -0,0 +1,151 @@
+""" Cached ACL evaluation for the object-level security demo.
+
+Every ``Page`` owned by the same user has an identical ACL, so there is no
+need to rebuild it on every access or to re-evaluate it for every
+permission check. ``acl_property`` caches an object's ACL until the
+attributes it depends on change and interns the result so that equal ACLs
+are the very same object. ``CachedACLAuthorizationPolicy`` uses that
+identity to remember the outcome of a check for a given lineage of ACLs,
+principal set and permission, and evaluates a whole collection of
+contexts in one pass by checking each distinct ACL only once.
+"""
+import threading
+
+from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.interfaces import IAuthorizationPolicy
+from pyramid.location import lineage
+
+from cache import LRUCache
+
+class CompiledACL(tuple):
+    """ An immutable, interned ACL. Compare these by identity."""
+
+_INTERNED = {}
+_INTERN_LOCK = threading.Lock()
+
+def intern_acl(acl):
+    """ Return the :class:`CompiledACL` equal to ``acl``."""
+    key = tuple(acl)
+    compiled = _INTERNED.get(key)
+    if compiled is None:
+        with _INTERN_LOCK:
+            compiled = _INTERNED.setdefault(key, CompiledACL(key))
+    return compiled
+
+class acl_property(object):
+    """ Decorate an ``__acl__`` method whose result depends only on ``attrs``.
+
+    The ACL is computed on first access and reused until one of ``attrs``
+    changes value.
+    """
+    cache_attr = '_acl_cache'
+
+    def __init__(self, *attrs):
+        self.attrs = attrs
+
+    def __call__(self, fn):
+        self.fn = fn
+        self.__doc__ = fn.__doc__
+        return self
+
+    def __get__(self, inst, cls=None):
+        if inst is None:
+            return self
+        key = tuple(getattr(inst, attr) for attr in self.attrs)
+        cached = getattr(inst, self.cache_attr, None)
+        if cached is None or cached[0] != key:
+            cached = (key, intern_acl(self.fn(inst)))
+            setattr(inst, self.cache_attr, cached)
+        return cached[1]
+
+def _stable_acl(location):
+    """ Return the ACL of ``location`` and whether it may be cached on.
+
+    Only interned ACLs and ACLs defined directly on a class live long
+    enough for their identity to be used as a cache key.
+    """
+    try:
+        acl = location.__acl__
+    except AttributeError:
+        return None, True
+    if isinstance(acl, CompiledACL):
+        return acl, True
+    return acl, acl is getattr(type(location), '__acl__', None)
+
+class CachedACLAuthorizationPolicy(ACLAuthorizationPolicy):
+    """ An ``ACLAuthorizationPolicy`` which memoizes ``permits``.
+
+    Results are cached by the identity of every ACL in the context's
+    lineage, the set of principals and the permission. Lineages containing
+    an ACL which is neither interned nor a class attribute are evaluated
+    normally on every call.
+    """
+    def __init__(self, maxsize=10000):
+        super().__init__()
+        self._results = LRUCache(maxsize)
+
+    def permits(self, context, principals, permission):
+        locations = []
+        acl_ids = []
+        for location in lineage(context):
+            acl, stable = _stable_acl(location)
+            if not stable:
+                return super().permits(context, principals, permission)
+            locations.append(location)
+            acl_ids.append(id(acl))
+
+        key = (tuple(acl_ids), frozenset(principals), permission)
+        cached = self._results.get(key)
+        if cached is None:
+            result = super().permits(context, principals, permission)
+            depth = None
+            for idx, location in enumerate(locations):
+                if location is result.context:
+                    depth = idx
+                    break
+            self._results.set(key, (result, depth))
+            return result
+
+        result, depth = cached
+        location = context if depth is None else locations[depth]
+        return result.__class__(
+            result.ace, result.acl, permission, principals, location)
+
+    def filter_permitted(self, contexts, principals, permission):
+        """ Return the members of ``contexts`` granting ``permission``.
+
+        Contexts with the same interned ACL and the same parent share a
+        lineage of ACLs, so only the first of them is evaluated.
+        """
+        principals = frozenset(principals)
+        outcomes = {}
+        permitted = []
+        for context in contexts:
+            acl, stable = _stable_acl(context)
+            if not stable:
+                if self.permits(context, principals, permission):
+                    permitted.append(context)
+                continue
+            key = (id(acl), id(getattr(context, '__parent__', None)))
+            allowed = outcomes.get(key)
+            if allowed is None:
+                allowed = outcomes[key] = bool(
+                    self.permits(context, principals, permission))
+            if allowed:
+                permitted.append(context)
+        return permitted
+
+def filter_permitted(request, permission, contexts):
+    """ Return the members of ``contexts`` on which the current user has
+    ``permission``, preserving their order.
+
+    Meant to be added as a request method. Falls back to checking every
+    context with ``request.has_permission`` if the authorization policy
+    cannot evaluate them in bulk.
+    """
+    policy = request.registry.queryUtility(IAuthorizationPolicy)
+    bulk = getattr(policy, 'filter_permitted', None)
+    if bulk is None:
+        return [context for context in contexts
+                if request.has_permission(permission, context)]
+    return bulk(contexts, request.effective_principals, permission)
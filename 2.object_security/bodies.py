@@ -0,0 +1,81 @@
+""" Page bodies kept in a memory-mapped file instead of on the heap.
+
+Listings only need a page's title, uri and owner, yet every ``Page`` in
+the memory store holds its full body. When ``store.bodies`` names a
+directory, the memory store appends each body it is given to a
+:class:`BodyFile` there and keeps a :class:`StoredBody` on the page, which
+reads the body back only when ``page.body`` is used. Resident memory then
+grows with the number of pages rather than with the size of their bodies,
+and the operating system's page cache decides which bodies stay in RAM.
+
+The file is append-only: a body is never changed once written, so readers
+need no lock and a ``StoredBody`` stays valid for the life of the file.
+Bodies replaced by an edit are not reclaimed; the file belongs to one
+process, is created empty at startup and removed by ``close()``. Pick a
+directory on a disk, not on a RAM backed ``tmpfs``.
+"""
+import mmap
+import os
+import tempfile
+import threading
+
+class StoredBody(object):
+    """ The location of one body in a :class:`BodyFile`."""
+    __slots__ = ('file', 'offset', 'length')
+
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    def read(self):
+        return self.file.read(self.offset, self.length)
+
+class BodyFile(object):
+    """ An append-only file of UTF-8 encoded bodies, read through mmap.
+
+    The file is grown ahead of the data by doubling its size, and mapped
+    again each time it grows. Maps which were replaced are not closed, a
+    reader may still be using one; they go away with their last reference.
+    """
+    initial_size = 1 << 20
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(
+            prefix='bodies-', suffix='.bin', dir=directory)
+        self._file = os.fdopen(fd, 'r+b')
+        self._lock = threading.Lock()
+        self.size = 0
+        self.capacity = 0
+        self._map = None
+        self._grow(self.initial_size)
+
+    def _grow(self, capacity):
+        self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+        self.capacity = capacity
+
+    def append(self, body):
+        """ Write ``body`` and return a :class:`StoredBody` for it."""
+        data = body.encode('utf-8')
+        with self._lock:
+            offset = self.size
+            end = offset + len(data)
+            if end > self.capacity:
+                self._grow(max(end, 2 * self.capacity))
+            self._map[offset:end] = data
+            self.size = end
+        return StoredBody(self, offset, len(data))
+
+    def read(self, offset, length):
+        return self._map[offset:offset + length].decode('utf-8')
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._map = None
+            self._file.close()
+            self._file = None
+            os.remove(self.path)
@@ -0,0 +1,104 @@
+""" gzip / deflate compression of responses.
+
+``compress_response`` is used by the compression tween in ``demo.py``.
+Responses with a known body are only compressed when they are at least
+``min_size`` bytes long; streamed responses are compressed chunk by chunk
+as they are sent.
+"""
+import zlib
+
+COMPRESSIBLE_TYPES = frozenset([
+    'application/javascript',
+    'application/json',
+    'text/css',
+    'text/html',
+    'text/plain',
+])
+
+# zlib's wbits for each content coding
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+def choose_encoding(request):
+    """ Return the coding the client prefers, or ``None``.
+
+    Only codings the client names in ``Accept-Encoding`` count. WebOb
+    treats a missing or unparsable header, and ``*``, as accepting
+    anything, but plain clients send no header and expect a plain body.
+    """
+    parsed = getattr(request.accept_encoding, 'parsed', None)
+    if not parsed:
+        return None
+    best = None
+    for coding, q in parsed:
+        coding = coding.lower()
+        if coding in WBITS and q > 0 and (best is None or q > best[1]):
+            best = (coding, q)
+    if best is not None:
+        return best[0]
+
+def weaken_etag(response):
+    """ Turn a strong ``ETag`` of ``response`` into a weak one.
+
+    A compressed body is not byte for byte the same representation as the
+    plain one, so the two must not share a strong validator.
+    """
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response.etag = (response.etag, False)
+
+def _compressor(encoding, level):
+    return zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+
+def _compress_iter(app_iter, encoding, level):
+    compressor = _compressor(encoding, level)
+    try:
+        for chunk in app_iter:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+            # send what the application produced so far right away
+            yield compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        close = getattr(app_iter, 'close', None)
+        if close is not None:
+            close()
+
+def compress_response(request, response, min_size=1024, level=6):
+    """ Compress ``response`` in place if it is worth it.
+
+    Returns ``True`` if the response was compressed.
+    """
+    # a 304 has no content type but stands for the 200 the client holds
+    not_modified = response.status_code == 304
+    if not not_modified and response.content_type not in COMPRESSIBLE_TYPES:
+        return False
+    vary = tuple(response.vary or ())
+    if 'Accept-Encoding' not in vary:
+        response.vary = vary + ('Accept-Encoding',)
+    if response.content_encoding:
+        return False
+    encoding = choose_encoding(request)
+    if encoding is None:
+        return False
+    # weakened whether or not this body turns out to be worth compressing,
+    # so the validator a client holds does not depend on the body's size
+    weaken_etag(response)
+    if response.status_code != 200 or request.method == 'HEAD':
+        return False
+
+    if response.content_length is None:
+        response.app_iter = _compress_iter(
+            response.app_iter, encoding, level)
+        response.content_length = None
+    else:
+        if response.content_length < min_size:
+            return False
+        compressor = _compressor(encoding, level)
+        response.body = compressor.compress(response.body) \
+            + compressor.flush()
+    response.content_encoding = encoding
+    return True
@@ -1,74 +1,149 @@
+import copy
+import glob
+import hashlib
+import itertools
+import os
+import sys
 import urllib.parse
 
 from pyramid.authentication import AuthTktAuthenticationPolicy
-from pyramid.authorization import ACLAuthorizationPolicy
 from pyramid.config import Configurator
+from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.httpexceptions import HTTPForbidden
 from pyramid.httpexceptions import HTTPFound
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.renderers import render
+from pyramid.response import Response
 from pyramid.security import ALL_PERMISSIONS
 from pyramid.security import Allow
 from pyramid.security import Authenticated
 from pyramid.security import Everyone
 from pyramid.security import forget
 from pyramid.security import remember
+from pyramid.settings import asbool
+from pyramid.events import ContextFound
+from pyramid.events import subscriber
+from pyramid.threadlocal import get_current_request
 from pyramid.view import forbidden_view_config
 from pyramid.view import view_config
 
+from acl import CachedACLAuthorizationPolicy
+from acl import acl_property
+from acl import filter_permitted
+from cache import LRUCache
+from cache import SizedLRUCache
+from cache import memoize_principals
+from compress import compress_response
+from journal import open_journal
+from passwords import LoginThrottle
+from passwords import PasswordHasher
+from precompile import precompile_templates
+from sanitize import POLICY as SANITIZER_POLICY
+from sanitize import Resanitizer
+from sanitize import cached_sanitize
+from sanitize import sanitize
+from sanitize import sanitized_body
+from search import build_index
+from sessions import SessionAuthenticationPolicy
+from sessions import open_session_store
+from store import open_store
+from timing import RequestTimer
+from timing import TimedAuthenticationPolicy
+from timing import TimedAuthorizationPolicy
+from timing import TimingStats
+from timing import time_renderers
+from timing import timed
+
 ### DEFINE MODEL
 class User(object):
-    @property
+    @acl_property('login')
     def __acl__(self):
         return [
             (Allow, self.login, 'view'),
         ]
 
+    # a worker may hold a great many users and pages, so neither carries a
+    # __dict__ and the names they repeat are interned to be shared
+    __slots__ = ('login', 'password', 'groups', '_acl_cache',
+                 '__parent__', '__name__')
+
     def __init__(self, login, password, groups=None):
-        self.login = login
+        self.login = sys.intern(login)
         self.password = password
-        self.groups = groups or []
+        self.groups = tuple(sys.intern(g) for g in groups or ())
 
-    def check_password(self, passwd):
-        return self.password == passwd
+    def check_password(self, passwd, hasher):
+        return hasher.verify(self.login, passwd, self.password)
 
 class Page(object):
-    @property
+    @acl_property('owner')
     def __acl__(self):
         return [
             (Allow, self.owner, 'edit'),
             (Allow, 'g:editor', 'edit'),
         ]
 
-    def __init__(self, title, uri, body, owner):
+    __slots__ = ('title', 'uri', '_body', 'owner', 'sanitized', 'version',
+                 '_acl_cache', '__parent__', '__name__')
+
+    def __init__(self, title, uri, body, owner, sanitized=0):
         self.title = title
         self.uri = uri
         self.body = body
-        self.owner = owner
+        self.owner = sys.intern(owner)
+        # the sanitizer policy version the body was cleaned with
+        self.sanitized = sanitized
+
+    @property
+    def body(self):
+        # the store may have moved the body to a file, see bodies.py
+        body = self._body
+        return body if isinstance(body, str) else body.read()
+
+    @body.setter
+    def body(self, body):
+        self._body = body
 
 def websafe_uri(txt):
     uri = txt.replace(' ', '-')
     return urllib.parse.quote(uri)
 
 ### INITIALIZE MODEL
-USERS = {}
-PAGES = {}
-
-def _make_demo_user(login, **kw):
-    kw.setdefault('password', login)
-    USERS[login] = User(login, **kw)
-    return USERS[login]
-
-_make_demo_user('luser')
-_make_demo_user('editor', groups=['editor'])
-_make_demo_user('admin', groups=['admin'])
-
-def _make_demo_page(title, **kw):
-    uri = kw.setdefault('uri', websafe_uri(title))
-    PAGES[uri] = Page(title, **kw)
-    return PAGES[uri]
-
-_make_demo_page('hello', owner='luser',
-                body='''
-<h3>Hello World!</h3><p>I'm the body text</p>''')
+# the demo accounts' passwords are the same as their logins
+DEMO_LOGINS = ['luser', 'editor', 'admin']
+
+def _make_demo_user(hasher, login, **kw):
+    kw['password'] = hasher.hash(kw.get('password', login))
+    return User(login, **kw)
+
+def _make_demo_page(store, title, search_index=None, **kw):
+    kw.setdefault('uri', websafe_uri(title))
+    page = Page(title, **kw)
+    store.pages.add(page)
+    if search_index is not None:
+        search_index.add(page)
+    return page
+
+def _init_demo_data(store, hasher):
+    # every process sharing a store gets here, the store adds the data
+    # only once; skip hashing the passwords if it has been added already
+    if len(store.users):
+        return
+
+    store.seed([
+        _make_demo_user(hasher, 'luser'),
+        _make_demo_user(hasher, 'editor', groups=['editor']),
+        _make_demo_user(hasher, 'admin', groups=['admin']),
+    ], [
+        Page('hello', uri=websafe_uri('hello'), owner='luser',
+             body='''
+<h3>Hello World!</h3><p>I'm the body text</p>''',
+             sanitized=SANITIZER_POLICY.version),
+    ])
+
+def get_store(request):
+    return request.registry.store
 
 ### MAP GROUPS TO PERMISSIONS
 class RootFactory(object):
@@ -88,7 +163,9 @@ class UserFactory(object):
         self.request = request
 
     def __getitem__(self, key):
-        user = USERS[key]
+        # the store may hand the same object to other threads, so locate
+        # a copy instead of changing it
+        user = copy.copy(self.request.store.users[key])
         user.__parent__ = self
         user.__name__ = key
         return user
@@ -103,16 +180,72 @@ class PageFactory(object):
         self.request = request
 
     def __getitem__(self, key):
-        page = PAGES[key]
+        return self.locate(self.request.store.pages[key])
+
+    def locate(self, page):
+        # the store may hand the same object to other threads, so locate
+        # a copy instead of changing it
+        page = copy.copy(page)
         page.__parent__ = self
-        page.__name__ = key
+        page.__name__ = page.uri
         return page
 
 def groupfinder(userid, request):
-    user = USERS.get(userid)
+    user = request.store.users.get(userid)
     if user:
         return ['g:%s' % g for g in user.groups]
 
+### CONDITIONAL GET
+def listing_etag(request):
+    """ Compute an ETag for a listing without rendering it.
+
+    A listing only changes when a page or a user is written, and those
+    writes bump the store's generation counters. What the caller sees also
+    depends on who they are and on the query string (e.g. ``after``).
+    """
+    store = request.store
+    key = (
+        request.registry.etag_seed,
+        request.matched_route.name,
+        store.pages.generation(),
+        store.users.generation(),
+        request.authenticated_userid,
+        request.query_string,
+    )
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+def conditional_listing(view):
+    """ Answer a listing view with 304 if the client's copy is current.
+
+    Used as a view ``decorator`` so the permission check has already
+    passed, while the view and its template have not run yet.
+    """
+    def wrapper(context, request):
+        etag = listing_etag(request)
+        if etag in request.if_none_match:
+            response = HTTPNotModified()
+        else:
+            response = view(context, request)
+        # weak, because the compressed body differs from the plain one
+        response.etag = (etag, False)
+        response.cache_control = 'private, no-cache'
+        response.vary = ('Cookie',)
+        return response
+    return wrapper
+
+def page_etag(request, page):
+    # versions are only unique within one store; a memory store restored
+    # from its journal numbers the pages afresh
+    return '%s.%s.%d' % (request.store.ident, page.uri, page.version)
+
+def code_fingerprint():
+    """ Return a value which changes when the demo or its templates do,
+    so that ETags handed out by a previous deploy are not honoured."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    paths = [os.path.abspath(__file__)]
+    paths += glob.glob(os.path.join(here, 'templates', '*.mako'))
+    return max(os.stat(path).st_mtime_ns for path in paths)
+
 ### DEFINE VIEWS
 @forbidden_view_config()
 def forbidden_view(request):
@@ -120,6 +253,11 @@ def forbidden_view(request):
     if request.authenticated_userid is not None:
         return HTTPForbidden()
 
+    # API clients cannot follow a redirect to the login form
+    route = request.matched_route
+    if route is not None and route.name.startswith('api_'):
+        return HTTPForbidden()
+
     loc = request.route_url('login', _query=(('next', request.path),))
     return HTTPFound(location=loc)
 
@@ -129,11 +267,11 @@ def forbidden_view(request):
 )
 def home_view(request):
     login = request.authenticated_userid
-    user = USERS.get(login)
+    user = request.store.users.get(login)
 
     return {
         'user': user,
-        'user_pages': [p for (t, p) in PAGES.items() if p.owner == login],
+        'user_pages': request.store.pages.by_owner(login),
     }
 
 @view_config(
@@ -144,21 +282,37 @@ def login_view(request):
     next = request.params.get('next') or request.route_url('home')
     login = ''
     did_fail = False
+    throttled = False
     if 'submit' in request.POST:
         login = request.POST.get('login', '')
         passwd = request.POST.get('passwd', '')
 
-        user = USERS.get(login, None)
-        if user and user.check_password(passwd):
-            headers = remember(request, login)
-            return HTTPFound(location=next, headers=headers)
-        did_fail = True
+        # reject bursts before paying for a password hash
+        throttle = request.registry.login_throttle
+        if not throttle.allow(login, request.remote_addr):
+            throttled = True
+            request.response.status = 429
+        else:
+            hasher = request.registry.password_hasher
+            user = request.store.users.get(login)
+            if user is None:
+                # as slow as a wrong password, so the response time does
+                # not tell which logins exist
+                hasher.verify_missing(login, passwd)
+            elif user.check_password(passwd, hasher):
+                if hasher.needs_rehash(user.password):
+                    request.store.users.add(User(
+                        login, hasher.hash(passwd), user.groups))
+                headers = remember(request, login)
+                return HTTPFound(location=next, headers=headers)
+            did_fail = True
 
     return {
         'login': login,
         'next': next,
         'failed_attempt': did_fail,
-        'users': USERS,
+        'throttled': throttled,
+        'users': [(name, name) for name in DEMO_LOGINS],
     }
 
 @view_config(
@@ -173,20 +327,22 @@ def logout_view(request):
     route_name='users',
     permission='view',
     renderer='users.mako',
+    decorator=conditional_listing,
 )
 def users_view(request):
     return {
-        'users': sorted(USERS.keys()),
+        'users': request.store.users.logins(),
     }
 
 @view_config(
     route_name='user',
     permission='view',
     renderer='user.mako',
+    decorator=conditional_listing,
 )
 def user_view(request):
     user = request.context
-    pages = [p for (t, p) in PAGES.items() if p.owner == user.login]
+    pages = request.store.pages.by_owner(user.login)
 
     return {
         'user': user,
@@ -197,22 +353,192 @@ def user_view(request):
     route_name='pages',
     permission='view',
     renderer='pages.mako',
+    decorator=conditional_listing,
 )
 def pages_view(request):
+    settings = request.registry.settings
+    page_size = int(settings.get('pages.page_size', 100))
+    after = request.params.get('after') or None
+
+    if asbool(settings.get('pages.stream', False)):
+        return stream_pages(request, after, page_size)
+
+    # fetch one extra page to find out whether there is another batch
+    pages = request.store.pages.listing(after, page_size + 1)
+    next_url = None
+    if len(pages) > page_size:
+        pages = pages[:page_size]
+        next_url = request.route_url(
+            'pages', _query=(('after', pages[-1].uri),))
+
     return {
-        'pages': PAGES.values(),
+        'pages': pages,
+        'editable': editable_uris(request, request.context, pages),
+        'next_url': next_url,
     }
 
+def editable_uris(request, factory, pages):
+    pages = [factory.locate(page) for page in pages]
+    return {page.uri for page in request.filter_permitted('edit', pages)}
+
+def stream_pages(request, after, chunk_size):
+    """ Send the page listing in chunks of ``chunk_size`` pages.
+
+    The surrounding layout is rendered once and split around a marker.
+    Each chunk is rendered with the ``page_list`` def from pages.mako as
+    the WSGI server asks for it, so only one chunk is ever held in memory.
+    The chunks all come from the one snapshot of the pages taken here, so
+    concurrent edits cannot list a page twice or skip it.
+    """
+    marker = '<!-- page list -->'
+    layout = render('pages.mako', {
+        'pages': None,
+        'editable': None,
+        'next_url': None,
+        'stream_marker': marker,
+    }, request=request)
+    head, tail = layout.split(marker, 1)
+    # the chunks are rendered after the router has finished with the
+    # request and removed its context
+    factory = request.context
+    listing = request.store.pages.iter_listing(after)
+
+    def app_iter():
+        try:
+            yield head.encode('utf-8')
+            while True:
+                pages = list(itertools.islice(listing, chunk_size))
+                if not pages:
+                    break
+                html = render('pages#page_list.mako', {
+                    'pages': pages,
+                    'editable': editable_uris(request, factory, pages),
+                }, request=request)
+                yield html.encode('utf-8')
+            yield tail.encode('utf-8')
+        finally:
+            # lets go of the snapshot when the client goes away early
+            listing.close()
+
+    return Response(app_iter=app_iter(), content_type='text/html',
+                    charset='utf-8')
+
 @view_config(
     route_name='page',
     permission='view',
-    renderer='page.mako',
 )
 def page_view(request):
     page = request.context
 
+    # a page's version changes on every edit, so a reader holding the
+    # current version does not need the page sent again
+    etag = page_etag(request, page)
+    if etag in request.if_none_match:
+        response = HTTPNotModified()
+        response.etag = etag
+        return response
+
+    cache = request.registry.page_cache
+    key = (request.application_url, page.uri, page.version)
+    body = cache.get(key)
+    if body is None:
+        body = render('page.mako', {
+            'page': page,
+            'body': sanitized_body(
+                page, cache=request.registry.sanitize_cache),
+        }, request=request)
+        body = body.encode('utf-8')
+        cache.set(key, body)
+
+    response = Response(body, content_type='text/html', charset='utf-8')
+    # the compression tween weakens it when the client accepts gzip
+    response.etag = etag
+    return response
+
+@view_config(
+    route_name='page_history',
+    permission='view',
+    renderer='history.mako',
+)
+def page_history_view(request):
+    page = request.context
+    return {
+        'page': page,
+        'revisions': request.store.pages.history(page.uri)[::-1],
+    }
+
+@view_config(
+    route_name='page_revision',
+    permission='view',
+    renderer='revision.mako',
+)
+def page_revision_view(request):
+    page = request.context
+    number = int(request.matchdict['n'])
+
+    # a revision never changes, but whether it is the latest one does and
+    # the page's version tells
+    etag = '%s.r%d' % (page_etag(request, page), number)
+    if etag in request.if_none_match:
+        response = HTTPNotModified()
+        response.etag = etag
+        return response
+
+    found = request.store.pages.revision(page.uri, number)
+    if found is None:
+        raise HTTPNotFound()
+    revision, body = found
+    request.response.etag = etag
     return {
         'page': page,
+        'revision': revision,
+        # revisions keep the bodies as they were written, possibly under
+        # an older policy; the page's version tells its history apart
+        # from that of an earlier page with the same uri
+        'body': cached_sanitize(
+            body, (page.uri, page.version, number),
+            request.registry.sanitize_cache),
+        'latest': len(request.store.pages.history(page.uri)),
+    }
+
+@view_config(
+    route_name='search',
+    permission='view',
+    renderer='search.mako',
+)
+def search_view(request):
+    q = request.params.get('q', '').strip()
+    limit = int(request.registry.settings.get('search.max_results', 50))
+
+    pages = []
+    truncated = False
+    if q:
+        index = request.registry.search_index
+        # pick up the pages other processes sharing the store wrote
+        index.refresh(request.store.pages)
+        uris = index.search(q)
+        # the index knows nothing about permissions, so keep checking
+        # batches of matches until one more than the limit is visible
+        while len(pages) <= limit:
+            chunk = list(itertools.islice(uris, limit + 1 - len(pages)))
+            if not chunk:
+                break
+            batch = []
+            for uri in chunk:
+                page = request.store.pages.get(uri)
+                if page is None:
+                    # removed, possibly by another process
+                    index.remove(uri)
+                else:
+                    batch.append(request.context.locate(page))
+            pages += request.filter_permitted('view', batch)
+        truncated = len(pages) > limit
+        pages = sorted(pages[:limit], key=lambda page: page.title)
+
+    return {
+        'q': q,
+        'pages': pages,
+        'truncated': truncated,
     }
 
 def validate_page(title, body):
@@ -224,7 +550,9 @@ def validate_page(title, body):
     elif len(title) > 32:
         errors.append('Title may not be longer than 32 characters')
 
-    body = body.strip()
+    # bodies are rendered as is, so clean them once here rather than on
+    # every view
+    body = sanitize(body).strip()
     if not body:
         errors.append('Body may not be empty')
 
@@ -254,7 +582,10 @@ def create_page_view(request):
         errors += v['errors']
 
         if not errors:
-            page = _make_demo_page(title, owner=owner, body=body)
+            page = _make_demo_page(request.store, title,
+                                   request.registry.search_index,
+                                   owner=owner, body=body,
+                                   sanitized=SANITIZER_POLICY.version)
             url = request.route_url('page', title=page.uri)
             return HTTPFound(location=url)
 
@@ -287,11 +618,16 @@ def edit_page_view(request):
         errors += v['errors']
 
         if not errors:
-            del PAGES[uri]
-            page.title = title
-            page.body = body
-            page.uri = websafe_uri(title)
-            PAGES[page.uri] = page
+            # pages are shared with concurrent requests, so publish an
+            # edited copy rather than changing the page in place
+            page = Page(title, websafe_uri(title), body, page.owner,
+                        SANITIZER_POLICY.version)
+            try:
+                request.store.pages.move(uri, page)
+            except KeyError:
+                # removed or renamed by a concurrent edit
+                raise HTTPNotFound()
+            request.registry.search_index.update(uri, page)
             url = request.route_url('page', title=page.uri)
             return HTTPFound(location=url)
 
@@ -302,15 +638,290 @@ def edit_page_view(request):
         'errors': errors,
     }
 
+### JSON API
+def page_info(request, page):
+    return {
+        'uri': page.uri,
+        'title': page.title,
+        'owner': page.owner,
+        'version': page.version,
+        'url': request.route_url('api_page', title=page.uri),
+    }
+
+def page_json(request, page):
+    info = page_info(request, page)
+    info['body'] = sanitized_body(
+        page, cache=request.registry.sanitize_cache)
+    return info
+
+@view_config(
+    route_name='api_pages',
+    permission='view',
+    renderer='json',
+    decorator=conditional_listing,
+)
+def api_pages_view(request):
+    page_size = int(request.registry.settings.get('pages.page_size', 100))
+    after = request.params.get('after') or None
+
+    pages = request.store.pages.listing(after, page_size + 1)
+    next_after = None
+    if len(pages) > page_size:
+        pages = pages[:page_size]
+        next_after = pages[-1].uri
+
+    editable = editable_uris(request, request.context, pages)
+    result = []
+    for page in pages:
+        info = page_info(request, page)
+        info['editable'] = page.uri in editable
+        result.append(info)
+    return {
+        'pages': result,
+        'next_after': next_after,
+    }
+
+@view_config(
+    route_name='api_users',
+    permission='view',
+    renderer='json',
+    decorator=conditional_listing,
+)
+def api_users_view(request):
+    return {
+        'users': request.store.users.logins(),
+    }
+
+@view_config(
+    route_name='api_page',
+    permission='view',
+    renderer='json',
+)
+def api_page_view(request):
+    page = request.context
+    etag = page_etag(request, page)
+    if etag in request.if_none_match:
+        response = HTTPNotModified()
+        response.etag = etag
+        return response
+
+    request.response.etag = etag
+    return page_json(request, page)
+
+@view_config(
+    route_name='api_pages_batch',
+    request_method='POST',
+    permission='view',
+    renderer='json',
+)
+def api_pages_batch_view(request):
+    """ Return many pages at once.
+
+    Expects a JSON body of the form ``{"uris": ["hello", ...]}`` and
+    returns the pages the caller may view in the requested order. Uris
+    which do not exist and those the caller may not view are both listed
+    under ``missing`` so that a batch does not reveal hidden pages.
+    """
+    max_uris = int(request.registry.settings.get('api.batch.max_uris', 1000))
+    try:
+        uris = request.json_body['uris']
+    except (ValueError, KeyError, TypeError):
+        uris = None
+    if not isinstance(uris, list) \
+            or not all(isinstance(uri, str) for uri in uris):
+        return HTTPBadRequest(json_body={
+            'error': 'expected a JSON object with a list of "uris"'})
+    if len(uris) > max_uris:
+        return HTTPBadRequest(json_body={
+            'error': 'at most %d uris may be requested at once' % max_uris})
+
+    uris = list(dict.fromkeys(uris))
+    found = request.store.pages.get_many(uris)
+    pages = [request.context.locate(found[uri])
+             for uri in uris if uri in found]
+    visible = request.filter_permitted('view', pages)
+    visible_uris = {page.uri for page in visible}
+
+    return {
+        'pages': [page_json(request, page) for page in visible],
+        'missing': [uri for uri in uris if uri not in visible_uris],
+    }
+
+### COMPRESSION
+def compression_tween_factory(handler, registry):
+    settings = registry.settings
+    min_size = int(settings.get('http.compress.min_size', 1024))
+    level = int(settings.get('http.compress.level', 6))
+
+    def compression_tween(request):
+        response = handler(request)
+        compress_response(request, response, min_size, level)
+        return response
+    return compression_tween
+
+### INSTRUMENTATION
+def timing_tween_factory(handler, registry):
+    stats = registry.timing_stats
+    server_timing = asbool(registry.settings.get('timing.server_timing'))
+
+    def timing_tween(request):
+        timer = request.timer = RequestTimer()
+        timer.start('traversal')
+        try:
+            response = handler(request)
+        finally:
+            timer.finish()
+        route = request.matched_route
+        stats.record(route.name if route else None, timer)
+        if server_timing:
+            response.headers['Server-Timing'] = timer.server_timing()
+        return response
+    return timing_tween
+
+@subscriber(ContextFound)
+def timing_context_found(event):
+    timer = getattr(event.request, 'timer', None)
+    if timer is not None:
+        timer.stop()
+        timer.start('view')
+
+@view_config(
+    route_name='timings',
+    permission='admin',
+    renderer='json',
+)
+def timings_view(request):
+    return request.registry.timing_stats.snapshot()
+
 ### CONFIGURE PYRAMID
+def add_views(config, timing):
+    """ Register the views and subscribers without a venusian scan.
+
+    This must be kept in line with the ``view_config`` and ``subscriber``
+    decorators above; it is used instead of ``config.scan`` when the
+    ``views.scan`` setting is false.
+    """
+    config.add_forbidden_view(forbidden_view)
+    config.add_view(home_view, route_name='home', renderer='home.mako')
+    config.add_view(login_view, route_name='login', renderer='login.mako')
+    config.add_view(logout_view, route_name='logout')
+    config.add_view(users_view, route_name='users', permission='view',
+                    renderer='users.mako', decorator=conditional_listing)
+    config.add_view(user_view, route_name='user', permission='view',
+                    renderer='user.mako', decorator=conditional_listing)
+    config.add_view(pages_view, route_name='pages', permission='view',
+                    renderer='pages.mako', decorator=conditional_listing)
+    config.add_view(page_view, route_name='page', permission='view')
+    config.add_view(page_history_view, route_name='page_history',
+                    permission='view', renderer='history.mako')
+    config.add_view(page_revision_view, route_name='page_revision',
+                    permission='view', renderer='revision.mako')
+    config.add_view(search_view, route_name='search', permission='view',
+                    renderer='search.mako')
+    config.add_view(create_page_view, route_name='create_page',
+                    permission='create', renderer='edit_page.mako')
+    config.add_view(edit_page_view, route_name='edit_page',
+                    permission='edit', renderer='edit_page.mako')
+    config.add_view(timings_view, route_name='timings', permission='admin',
+                    renderer='json')
+    config.add_view(api_pages_view, route_name='api_pages',
+                    permission='view', renderer='json',
+                    decorator=conditional_listing)
+    config.add_view(api_users_view, route_name='api_users',
+                    permission='view', renderer='json',
+                    decorator=conditional_listing)
+    config.add_view(api_page_view, route_name='api_page', permission='view',
+                    renderer='json')
+    config.add_view(api_pages_batch_view, route_name='api_pages_batch',
+                    request_method='POST', permission='view',
+                    renderer='json')
+    # the subscribers only do anything for requests with a timer
+    if timing:
+        config.add_subscriber(timing_context_found, ContextFound)
+
 def main(global_settings, **settings):
     config = Configurator(settings=settings)
 
-    authn_policy = AuthTktAuthenticationPolicy(
-        settings['auth.secret'],
-        callback=groupfinder,
+    hasher = PasswordHasher(
+        int(settings.get('auth.password.iterations', 200000)))
+    config.registry.password_hasher = hasher
+    config.registry.login_throttle = LoginThrottle(
+        float(settings.get('auth.login.rate', 0.2)),
+        int(settings.get('auth.login.burst', 5)),
+        float(settings.get('auth.login.addr_rate', 1)),
+        int(settings.get('auth.login.addr_burst', 20)),
     )
-    authz_policy = ACLAuthorizationPolicy()
+
+    store_url = settings.get('store.url', 'memory://')
+    store = open_store(store_url, User, Page,
+                       body_dir=settings.get('store.bodies') or None)
+    journal = settings.get('store.journal')
+    if journal:
+        if store_url != 'memory://':
+            raise ValueError('store.journal requires the memory:// store')
+        store = open_journal(
+            journal, store, User, Page,
+            int(settings.get('store.journal.compact_every', 10000)),
+            asbool(settings.get('store.journal.fsync', True)),
+        )
+    _init_demo_data(store, hasher)
+    config.registry.store = store
+    config.add_request_method(get_store, 'store', reify=True)
+    config.add_request_method(filter_permitted, 'filter_permitted')
+    config.registry.page_cache = SizedLRUCache(
+        int(settings.get('pages.render_cache.max_bytes', 64 * 1024 * 1024)))
+    config.registry.sanitize_cache = SizedLRUCache(
+        int(settings.get('pages.sanitize.cache.max_bytes', 16 * 1024 * 1024)))
+    config.registry.search_index = build_index(store)
+    config.registry.etag_seed = (store.ident, code_fingerprint())
+
+    principal_cache = None
+    cache_size = int(settings.get('auth.principal_cache.size', 0))
+    if cache_size:
+        principal_cache = LRUCache(
+            cache_size, float(settings.get('auth.principal_cache.ttl', 60)))
+        store.users.subscribe(principal_cache.invalidate)
+
+    timing = asbool(settings.get('timing.enabled', False))
+    config.registry.timing_stats = TimingStats()
+
+    callback = groupfinder
+    if timing:
+        callback = timed('groupfinder', groupfinder)
+
+    auth_policy = settings.get('auth.policy', 'authtkt')
+    if auth_policy == 'session':
+        # principals are looked up once at login and kept in the session,
+        # so sessions must not outlive a change to the user's groups
+        sessions = open_session_store(
+            settings.get('auth.session.url', 'memory://'),
+            int(settings.get('auth.session.max_sessions', 100000)))
+        store.users.subscribe(sessions.revoke_user)
+        config.registry.sessions = sessions
+        authn_policy = SessionAuthenticationPolicy(
+            sessions,
+            callback=callback,
+            timeout=float(settings.get('auth.session.timeout', 3600)),
+            secure=asbool(settings.get('auth.session.secure', False)),
+        )
+    elif auth_policy == 'authtkt':
+        authn_policy = AuthTktAuthenticationPolicy(
+            settings['auth.secret'],
+            callback=memoize_principals(callback, principal_cache),
+        )
+    else:
+        raise ValueError('unknown auth.policy: %r' % (auth_policy,))
+    authz_policy = CachedACLAuthorizationPolicy(
+        int(settings.get('auth.acl_cache.size', 10000)))
+
+    if timing:
+        authn_policy = TimedAuthenticationPolicy(authn_policy)
+        authz_policy = TimedAuthorizationPolicy(
+            authz_policy, get_current_request)
+        config.add_tween(__name__ + '.timing_tween_factory')
+
+    if asbool(settings.get('http.compress', True)):
+        config.add_tween(__name__ + '.compression_tween_factory')
 
     config.set_authentication_policy(authn_policy)
     config.set_authorization_policy(authz_policy)
@@ -319,6 +930,7 @@ def main(global_settings, **settings):
     config.add_route('home', '/')
     config.add_route('login', '/login')
     config.add_route('logout', '/logout')
+    config.add_route('timings', '/_timings')
 
     config.add_route('users', '/users', factory=UserFactory)
     config.add_route('user', '/user/{login}', factory=UserFactory,
@@ -330,15 +942,52 @@ def main(global_settings, **settings):
                      traverse='/{title}')
     config.add_route('edit_page', '/page/{title}/edit', factory=PageFactory,
                      traverse='/{title}')
+    config.add_route('page_history', '/page/{title}/history',
+                     factory=PageFactory, traverse='/{title}')
+    config.add_route('page_revision', r'/page/{title}/rev/{n:\d+}',
+                     factory=PageFactory, traverse='/{title}')
+    config.add_route('search', '/search', factory=PageFactory)
+
+    config.add_route('api_users', '/api/users', factory=UserFactory)
+    config.add_route('api_pages', '/api/pages', factory=PageFactory)
+    # a bare ':batchGet' would be read as an old style placeholder
+    config.add_route('api_pages_batch', '/api/pages{method::batchGet}',
+                     factory=PageFactory)
+    config.add_route('api_page', '/api/page/{title}', factory=PageFactory,
+                     traverse='/{title}')
 
     config.include('pyramid_mako')
-    config.scan(__name__)
-    return config.make_wsgi_app()
+    if asbool(settings.get('views.scan', True)):
+        config.scan(__name__)
+    else:
+        add_views(config, timing)
+    app = config.make_wsgi_app()
+
+    if asbool(settings.get('templates.precompile', False)):
+        precompile_templates(app.registry)
+    if timing:
+        # after precompiling, which needs the Mako renderer factory itself;
+        # the timing tween finishes the timer once the response is made
+        time_renderers(app.registry)
+
+    # clean the bodies stored under an older sanitizer policy; off by
+    # default because every process sharing a store would make the same
+    # pass, run scripts/pageio.py resanitize once instead
+    if asbool(settings.get('pages.sanitize.background', False)):
+        search_index = app.registry.search_index
+        app.registry.resanitizer = Resanitizer(
+            store, Page,
+            batch_size=int(settings.get('pages.sanitize.batch_size', 100)),
+            on_write=lambda page: search_index.update(page.uri, page),
+        )
+        app.registry.resanitizer.start()
+    return app
 
 ### SIMPLE STARTUP
 if __name__ == '__main__':
     settings = {
         'auth.secret': 'seekrit',
+        'store.url': os.environ.get('STORE_URL', 'memory://'),
         'mako.directories': '%s:templates' % __name__,
     }
     app = main({}, **settings)
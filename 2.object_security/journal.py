@@ -0,0 +1,446 @@
+""" A write-ahead journal making the memory store survive restarts.
+
+The memory store answers reads from dictionaries but forgets everything
+when the process exits. ``open_journal`` wraps it so that every write is
+first appended to ``journal.jsonl`` in the journal directory and only
+then applied to the store. When the application starts the journal is
+replayed on top of the last snapshot, ``snapshot.jsonl``.
+
+Every ``compact_every`` writes the journal is compacted, which bounds
+both its size and the time a restart spends replaying it: under the lock
+the journal is renamed to ``journal.old.jsonl`` and a new one started,
+then a background thread writes the store as it was at that moment to a
+new snapshot and deletes the old journal. Writers only wait for the
+rename, and reads of the copy-on-write page snapshot need no lock. All
+these files hold one JSON record per line::
+
+    {"op": "user", "login": "luser", "password": "...", "groups": []}
+    {"op": "groups", "login": "luser", "groups": ["editor"]}
+    {"op": "page", "uri": "hello", "title": "hello", "body": "...",
+     "owner": "luser", "sanitized": 1, "old_uri": "hi"}
+    {"op": "history", "uri": "hello", "revisions": [...]}
+    {"op": "compaction", "seq": 3}
+
+Records of edits carry ``old_uri`` even when the uri did not change, and
+are replayed as edits, which adds revisions to the pages' histories just
+as the original writes did. Snapshots hold the histories in ``history``
+records following the pages. Replaying collects the records in plain
+dictionaries and loads the result into the store in one write at the
+end, so a restart takes time in proportion to the records replayed.
+
+Compactions are numbered. The old journal ends with a ``compaction``
+record carrying the number, and the snapshot written from it starts with
+the same record. A restart replays the snapshot, then the old journal if
+a compaction did not finish, then the journal. An old journal which the
+snapshot already contains, left by a crash between writing the snapshot
+and deleting the old journal, is deleted rather than replayed. Should an
+edit be replayed on top of a state containing it all the same, a rename
+finds its page under the new uri and replaces it there, keeping the
+history. A record only partially written by a crash is dropped.
+
+Only one process may write to a journal; use the SQLite store to share
+data between processes.
+"""
+import json
+import os
+import shutil
+import threading
+
+from revisions import KEYFRAME_EVERY
+from revisions import edit_revisions
+from revisions import load_revision
+from revisions import revision_record
+
+def user_record(user):
+    return {
+        'op': 'user',
+        'login': user.login,
+        'password': user.password,
+        'groups': list(user.groups),
+    }
+
+def page_record(page, old_uri=None):
+    record = {
+        'op': 'page',
+        'uri': page.uri,
+        'title': page.title,
+        'body': page.body,
+        'owner': page.owner,
+        'sanitized': page.sanitized,
+    }
+    if old_uri is not None:
+        record['old_uri'] = old_uri
+    return record
+
+def compaction_record(sequence):
+    return {'op': 'compaction', 'seq': sequence}
+
+def _last_record(path):
+    # the compaction record ending a journal is short
+    with open(path, 'rb') as fp:
+        fp.seek(0, os.SEEK_END)
+        fp.seek(max(0, fp.tell() - 4096))
+        lines = fp.read().splitlines(True)
+    if not lines or not lines[-1].endswith(b'\n'):
+        return None
+    try:
+        return json.loads(lines[-1])
+    except ValueError:
+        return None
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Journal(object):
+    def __init__(self, directory, compact_every=10000, fsync=True):
+        self.directory = directory
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.journal_path = os.path.join(directory, 'journal.jsonl')
+        self.old_path = os.path.join(directory, 'journal.old.jsonl')
+        self.snapshot_path = os.path.join(directory, 'snapshot.jsonl')
+        # held while a write is journaled and applied, and while the
+        # journal is swapped for a new one, so a compaction never sees
+        # half a write
+        self.lock = threading.RLock()
+        self.pending = 0
+        # the number of the latest compaction
+        self.sequence = 0
+        self.store = None
+        self._file = None
+        self._compacting = False
+        self._thread = None
+
+    def replay(self, store, user_factory, page_factory):
+        """ Load the snapshot and the journal into ``store``.
+
+        Returns the number of records applied.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        replay = Replay(user_factory, page_factory,
+                        store.pages.keyframe_every)
+        count = 0
+        if os.path.exists(self.snapshot_path):
+            count += self._replay_file(self.snapshot_path, replay)
+        self.pending = 0
+        if os.path.exists(self.old_path):
+            last = _last_record(self.old_path)
+            if last is not None and last['op'] == 'compaction' \
+                    and last['seq'] <= replay.sequence:
+                os.remove(self.old_path)
+            else:
+                self.pending += self._replay_file(self.old_path, replay)
+        if os.path.exists(self.journal_path):
+            self.pending += self._replay_file(self.journal_path, replay)
+        count += self.pending
+        replay.load(store)
+        self.sequence = replay.sequence
+        self.store = store
+        self._file = open(self.journal_path, 'ab')
+        return count
+
+    def _replay_file(self, path, replay):
+        count = 0
+        good = 0
+        with open(path, 'rb') as fp:
+            for line in fp:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                replay.apply(record)
+                good += len(line)
+                count += 1
+        if good != os.path.getsize(path):
+            # drop the record torn by a crash so new ones follow a newline
+            with open(path, 'r+b') as fp:
+                fp.truncate(good)
+        return count
+
+    def append(self, *records):
+        data = b''.join(
+            json.dumps(record).encode('utf-8') + b'\n' for record in records)
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.pending += len(records)
+
+    def maybe_compact(self):
+        if self.compact_every and self.pending >= self.compact_every \
+                and not self._compacting:
+            self.compact(background=True)
+
+    def compact(self, background=False):
+        """ Write the store to a new snapshot and empty the journal.
+
+        With ``background`` the snapshot is written by a new thread and
+        this returns as soon as the journal was swapped. Returns False if
+        another compaction is still running.
+        """
+        with self.lock:
+            if self._compacting:
+                return False
+            self._compacting = True
+            try:
+                self._rotate()
+            except BaseException:
+                self._compacting = False
+                raise
+            # later writes leave the page snapshot as it is
+            users = [user for login, user in self.store.users.items()]
+            pages = self.store.pages.snapshot()
+            sequence = self.sequence
+        if background:
+            self._thread = threading.Thread(
+                target=self._write_snapshot, args=(sequence, users, pages),
+                name='journal-compact', daemon=True)
+            self._thread.start()
+        else:
+            self._write_snapshot(sequence, users, pages)
+        return True
+
+    def _rotate(self):
+        # the snapshot will claim the records up to here, so the claim
+        # must reach the disk whether or not writes are synced
+        self.sequence += 1
+        self._file.write(
+            json.dumps(compaction_record(self.sequence)).encode('utf-8'))
+        self._file.write(b'\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        if os.path.exists(self.old_path):
+            # left by a compaction which failed: keep the records in order
+            with open(self.journal_path, 'rb') as src, \
+                    open(self.old_path, 'ab') as dst:
+                shutil.copyfileobj(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, self.old_path)
+        self._file = open(self.journal_path, 'ab')
+        if self.fsync:
+            _fsync_dir(self.directory)
+        self.pending = 0
+
+    def _write_snapshot(self, sequence, users, pages):
+        try:
+            tmp = self.snapshot_path + '.tmp'
+            with open(tmp, 'wb') as fp:
+                fp.write(json.dumps(
+                    compaction_record(sequence)).encode('utf-8'))
+                fp.write(b'\n')
+                for user in users:
+                    fp.write(json.dumps(user_record(user)).encode('utf-8'))
+                    fp.write(b'\n')
+                for page in pages.pages():
+                    fp.write(json.dumps(page_record(page)).encode('utf-8'))
+                    fp.write(b'\n')
+                for uri, revisions in pages.history_items():
+                    fp.write(json.dumps({
+                        'op': 'history',
+                        'uri': uri,
+                        'revisions': [revision_record(revision)
+                                      for revision in revisions],
+                    }).encode('utf-8'))
+                    fp.write(b'\n')
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp, self.snapshot_path)
+            _fsync_dir(self.directory)
+            os.remove(self.old_path)
+        finally:
+            self._compacting = False
+
+    def close(self):
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class Replay(object):
+    """ The users, pages and histories read from a snapshot and journals.
+
+    ``apply`` keeps them in dictionaries, in which a record costs the same
+    however many came before it, and ``load`` adds them to an empty store.
+    """
+    def __init__(self, user_factory, page_factory,
+                 keyframe_every=KEYFRAME_EVERY):
+        self.user_factory = user_factory
+        self.page_factory = page_factory
+        self.keyframe_every = keyframe_every
+        self.users = {}
+        # in the order they were last written, which numbers their versions
+        self.pages = {}
+        self.histories = {}
+        self.sequence = 0
+
+    def apply(self, record):
+        op = record['op']
+        if op == 'user':
+            self.users[record['login']] = self.user_factory(
+                record['login'], password=record['password'],
+                groups=record['groups'])
+        elif op == 'groups':
+            user = self.users.get(record['login'])
+            if user is not None:
+                self.users[user.login] = self.user_factory(
+                    user.login, password=user.password,
+                    groups=record['groups'])
+        elif op == 'page':
+            page = self.page_factory(
+                record['title'], uri=record['uri'], body=record['body'],
+                owner=record['owner'], sanitized=record.get('sanitized', 0))
+            old_uri = record.get('old_uri')
+            old_page = None
+            if old_uri is not None:
+                old_page = self.pages.pop(old_uri, None)
+            current = self.pages.pop(page.uri, None)
+            if old_page is not None:
+                history = self.histories.pop(old_uri, None) or []
+                history.extend(edit_revisions(
+                    history, old_page, page, self.keyframe_every))
+                self.histories[page.uri] = history
+            elif old_uri is None or current is None:
+                # an add replaces a page along with its history
+                self.histories.pop(page.uri, None)
+            # otherwise the page was renamed already, by this very edit
+            # replayed on top of a snapshot containing it: replace it
+            # where it is and keep its history
+            self.pages[page.uri] = page
+        elif op == 'history':
+            self.histories[record['uri']] = [
+                load_revision(revision) for revision in record['revisions']]
+        elif op == 'compaction':
+            self.sequence = max(self.sequence, record['seq'])
+        else:
+            raise ValueError('unknown journal record: %r' % (record,))
+
+    def load(self, store):
+        store.users.add_many(self.users.values())
+        store.pages.add_many(self.pages.values())
+        store.pages.load_histories(self.histories.items())
+
+class JournaledUserRepository(object):
+    def __init__(self, users, journal):
+        self._users = users
+        self._journal = journal
+
+    def __getattr__(self, name):
+        return getattr(self._users, name)
+
+    def __getitem__(self, login):
+        return self._users[login]
+
+    def __contains__(self, login):
+        return login in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def add(self, user):
+        with self._journal.lock:
+            self._journal.append(user_record(user))
+            self._users.add(user)
+        self._journal.maybe_compact()
+
+    def add_many(self, users):
+        users = list(users)
+        with self._journal.lock:
+            self._journal.append(*[user_record(user) for user in users])
+            self._users.add_many(users)
+        self._journal.maybe_compact()
+
+    def set_groups(self, login, groups):
+        groups = list(groups)
+        with self._journal.lock:
+            if login not in self._users:
+                raise KeyError(login)
+            self._journal.append(
+                {'op': 'groups', 'login': login, 'groups': groups})
+            self._users.set_groups(login, groups)
+        self._journal.maybe_compact()
+
+class JournaledPageRepository(object):
+    def __init__(self, pages, journal):
+        self._pages = pages
+        self._journal = journal
+
+    def __getattr__(self, name):
+        return getattr(self._pages, name)
+
+    def __getitem__(self, uri):
+        return self._pages[uri]
+
+    def __contains__(self, uri):
+        return uri in self._pages
+
+    def __len__(self):
+        return len(self._pages)
+
+    def add(self, page):
+        with self._journal.lock:
+            self._journal.append(page_record(page))
+            self._pages.add(page)
+        self._journal.maybe_compact()
+
+    def add_many(self, pages):
+        pages = list(pages)
+        with self._journal.lock:
+            self._journal.append(*[page_record(page) for page in pages])
+            self._pages.add_many(pages)
+        self._journal.maybe_compact()
+
+    def move(self, old_uri, page, expect_version=None):
+        with self._journal.lock:
+            old_page = self._pages.get(old_uri)
+            if old_page is None:
+                if expect_version is not None:
+                    return False
+                raise KeyError(old_uri)
+            if expect_version is not None \
+                    and old_page.version != expect_version:
+                return False
+            self._journal.append(page_record(page, old_uri))
+            self._pages.move(old_uri, page)
+        self._journal.maybe_compact()
+        return True
+
+class JournaledStore(object):
+    def __init__(self, store, journal):
+        self.store = store
+        self.journal = journal
+        self.ident = store.ident
+        self.users = JournaledUserRepository(store.users, journal)
+        self.pages = JournaledPageRepository(store.pages, journal)
+
+    def seed(self, users, pages):
+        with self.journal.lock:
+            if len(self.users):
+                return False
+            self.users.add_many(users)
+            self.pages.add_many(pages)
+        return True
+
+    def close(self):
+        self.journal.close()
+        self.store.close()
+
+def open_journal(directory, store, user_factory, page_factory,
+                 compact_every=10000, fsync=True):
+    """ Replay the journal in ``directory`` into ``store`` and return a
+    store which journals every write."""
+    journal = Journal(directory, compact_every, fsync)
+    journal.replay(store, user_factory, page_factory)
+    return JournaledStore(store, journal)
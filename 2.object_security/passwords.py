@@ -0,0 +1,146 @@
+""" Password hashing and login throttling.
+
+Passwords are stored as salted PBKDF2 hashes. Hashing is deliberately
+slow, so two things keep it from becoming a bottleneck:
+
+- ``PasswordHasher`` remembers credentials it has recently verified, keyed
+  by an HMAC of the login, password and stored hash, so a user logging in
+  repeatedly only pays for the hash once.
+
+- ``RateLimiter`` keeps a token bucket per key (a login or a client
+  address) so bursts of attempts are rejected before any hashing happens.
+
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache import LRUCache
+
+def _b64(raw):
+    return base64.b64encode(raw).decode('ascii')
+
+class PasswordHasher(object):
+    """ Hash passwords as ``pbkdf2_sha256$<iterations>$<salt>$<hash>``.
+
+    Stored values which are not in this format are treated as legacy
+    plaintext passwords and compared in constant time.
+    """
+    algorithm = 'pbkdf2_sha256'
+
+    def __init__(self, iterations=200000, cache_size=1024, cache_ttl=300):
+        self.iterations = iterations
+        self._cache = None
+        if cache_size:
+            self._cache = LRUCache(cache_size, cache_ttl)
+        self._cache_key = os.urandom(32)
+        # random bytes rather than a derived key, so making it is free
+        self._dummy_hash = '%s$%d$%s$%s' % (
+            self.algorithm, iterations, _b64(os.urandom(16)),
+            _b64(os.urandom(32)))
+
+    def _derive(self, password, salt, iterations):
+        return hashlib.pbkdf2_hmac(
+            'sha256', password.encode('utf-8'), salt, iterations)
+
+    def hash(self, password):
+        salt = os.urandom(16)
+        digest = self._derive(password, salt, self.iterations)
+        return '%s$%d$%s$%s' % (
+            self.algorithm, self.iterations, _b64(salt), _b64(digest))
+
+    def _parse(self, stored):
+        parts = stored.split('$')
+        if len(parts) != 4 or parts[0] != self.algorithm:
+            return None
+        try:
+            return (
+                int(parts[1]),
+                base64.b64decode(parts[2]),
+                base64.b64decode(parts[3]),
+            )
+        except ValueError:
+            return None
+
+    def is_hash(self, stored):
+        return self._parse(stored) is not None
+
+    def needs_rehash(self, stored):
+        parsed = self._parse(stored)
+        return parsed is None or parsed[0] != self.iterations
+
+    def verify(self, login, password, stored):
+        key = None
+        if self._cache is not None:
+            key = hmac.new(self._cache_key, '\0'.join(
+                (login, password, stored)).encode('utf-8'),
+                hashlib.sha256).digest()
+            if self._cache.get(key):
+                return True
+
+        parsed = self._parse(stored)
+        if parsed is None:
+            ok = hmac.compare_digest(
+                password.encode('utf-8'), stored.encode('utf-8'))
+        else:
+            iterations, salt, expected = parsed
+            actual = self._derive(password, salt, iterations)
+            ok = hmac.compare_digest(actual, expected)
+
+        if ok and key is not None:
+            self._cache.set(key, True)
+        return ok
+
+    def verify_missing(self, login, password):
+        """ Do the work of ``verify`` for a login which does not exist.
+
+        The password is checked against a hash with the same parameters
+        as real ones but which no password matches, so a failed login
+        takes as long whether or not the login exists. Always ``False``.
+        """
+        self.verify(login, password, self._dummy_hash)
+        return False
+
+class RateLimiter(object):
+    """ A token bucket per key.
+
+    Each bucket holds at most ``burst`` tokens and regains ``rate`` tokens
+    per second. At most ``maxsize`` buckets are tracked; the least recently
+    used are forgotten first, which is the same as them being full.
+    """
+    def __init__(self, rate, burst, maxsize=100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key, cost=1):
+        now = self._clock()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed
+
+class LoginThrottle(object):
+    """ Limit login attempts per login and per client address."""
+    def __init__(self, login_rate, login_burst, addr_rate, addr_burst):
+        self.by_login = RateLimiter(login_rate, login_burst)
+        self.by_addr = RateLimiter(addr_rate, addr_burst)
+
+    def allow(self, login, addr):
+        # check the address first so that a flood from one client does
+        # not also drain the bucket of the login it is attacking
+        return self.by_addr.allow(addr) and self.by_login.allow(login)
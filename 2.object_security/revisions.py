@@ -0,0 +1,120 @@
+""" Page revision history stored as line deltas.
+
+Every edit of a page, i.e. every ``move`` in a page repository, adds a
+revision to the history of the page, which follows the page when its uri
+changes. A page which was never edited has no stored history; its only
+revision is the page itself, and its first edit stores it as revision 1.
+
+A revision's body is kept either whole, as a keyframe, or as a delta
+against the body of the revision before it: a list in which
+``[start, stop]`` copies those lines of the previous body and a string
+inserts new text. A keyframe is written at least every
+``keyframe_every`` revisions, so rebuilding any revision applies at most
+``keyframe_every - 1`` deltas however long the history grows. A delta
+which would not be smaller than the body is stored as a keyframe instead.
+"""
+import difflib
+
+FULL = 'full'
+DELTA = 'delta'
+
+KEYFRAME_EVERY = 16
+
+class Revision(object):
+    """ One revision of a page.
+
+    ``data`` is the body for a keyframe and the delta otherwise. It may
+    be ``None`` when only the history is listed.
+    """
+    __slots__ = ('number', 'title', 'owner', 'kind', 'data')
+
+    def __init__(self, number, title, owner, kind, data=None):
+        self.number = number
+        self.title = title
+        self.owner = owner
+        self.kind = kind
+        self.data = data
+
+def body_text(data):
+    # the memory store may keep keyframes in its body file, see bodies.py
+    return data if isinstance(data, str) else data.read()
+
+def make_delta(old, new):
+    """ Return the delta turning the body ``old`` into ``new``."""
+    old_lines = old.splitlines(True)
+    new_lines = new.splitlines(True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+    delta = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append(''.join(new_lines[j1:j2]))
+    return delta
+
+def apply_delta(old, delta):
+    old_lines = old.splitlines(True)
+    return ''.join(
+        op if isinstance(op, str) else ''.join(old_lines[op[0]:op[1]])
+        for op in delta)
+
+def delta_size(delta):
+    # a copied range costs about as much as a few characters
+    return sum(len(op) if isinstance(op, str) else 8 for op in delta)
+
+def next_revision(number, page, previous_body, since_keyframe,
+                  keyframe_every=KEYFRAME_EVERY):
+    """ Return revision ``number`` recording ``page``.
+
+    ``previous_body`` is the body of revision ``number - 1`` and
+    ``since_keyframe`` the number of revisions stored after its most
+    recent keyframe.
+    """
+    body = page.body
+    if since_keyframe + 1 < keyframe_every:
+        delta = make_delta(previous_body, body)
+        if delta_size(delta) < len(body):
+            return Revision(number, page.title, page.owner, DELTA, delta)
+    return Revision(number, page.title, page.owner, FULL, body)
+
+def edit_revisions(history, old_page, page,
+                   keyframe_every=KEYFRAME_EVERY):
+    """ Return the revisions to add to ``history`` when ``page`` replaces
+    ``old_page``.
+
+    ``history`` holds the stored revisions of ``old_page``, if it has any.
+    Otherwise ``old_page`` itself is returned as revision 1 as well.
+    """
+    added = []
+    if not history:
+        history = added = [
+            Revision(1, old_page.title, old_page.owner, FULL, old_page.body)]
+    since_keyframe = 0
+    while history[-1 - since_keyframe].kind != FULL:
+        since_keyframe += 1
+    revision = next_revision(
+        len(history) + 1, page, old_page.body, since_keyframe,
+        keyframe_every)
+    return added + [revision]
+
+def rebuild(revisions):
+    """ Return the body of the last of ``revisions``, which must be the
+    revisions following and including a keyframe."""
+    body = None
+    for revision in revisions:
+        if revision.kind == FULL:
+            body = body_text(revision.data)
+        else:
+            body = apply_delta(body, revision.data)
+    return body
+
+def revision_record(revision):
+    """ Return ``revision`` as a JSON serializable list."""
+    data = revision.data
+    if revision.kind == FULL:
+        data = body_text(data)
+    return [revision.number, revision.title, revision.owner, revision.kind,
+            data]
+
+def load_revision(record):
+    return Revision(*record)
@@ -0,0 +1,236 @@
+""" Write-time HTML sanitization of page bodies.
+
+Page bodies are user supplied HTML rendered as is, so they are cleaned
+once, when a page is created or edited, rather than on every view.
+``sanitize`` keeps only the tags and attributes a :class:`Policy` allows:
+
+- other tags are dropped but their text is kept, except for tags such as
+  ``script`` whose content is dropped too,
+- ``href`` and ``src`` attributes must be relative or use an allowed
+  scheme,
+- comments are dropped, text is escaped and open tags are closed.
+
+Every page records in ``sanitized`` the version of the policy its body was
+cleaned with, 0 if it never was. Changing the policy means bumping its
+version; a :class:`Resanitizer` then cleans the stored bodies again a
+batch at a time, run once by ``scripts/pageio.py resanitize`` or in the
+background of a single process (``pages.sanitize.background``).
+"""
+import html
+import html.parser
+import re
+import threading
+import time
+import urllib.parse
+
+class Policy(object):
+    """ What ``sanitize`` lets through.
+
+    ``attributes`` maps a tag to the attributes allowed on it, with the
+    ones under ``'*'`` allowed on every tag.
+    """
+    def __init__(self, version, tags, attributes, protocols, drop_content):
+        self.version = version
+        self.tags = frozenset(tags)
+        self.attributes = {tag: frozenset(names)
+                           for tag, names in attributes.items()}
+        self.protocols = frozenset(protocols)
+        self.drop_content = frozenset(drop_content)
+
+    def allowed_attributes(self, tag):
+        return self.attributes.get(tag, frozenset()) \
+            | self.attributes.get('*', frozenset())
+
+POLICY = Policy(
+    version=1,
+    tags=[
+        'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'dd', 'div', 'dl',
+        'dt', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img',
+        'li', 'ol', 'p', 'pre', 's', 'small', 'span', 'strong', 'sub', 'sup',
+        'table', 'tbody', 'td', 'th', 'thead', 'tr', 'u', 'ul',
+    ],
+    attributes={
+        '*': ['title'],
+        'a': ['href'],
+        'img': ['src', 'alt', 'width', 'height'],
+        'td': ['colspan', 'rowspan'],
+        'th': ['colspan', 'rowspan'],
+    },
+    protocols=['http', 'https', 'mailto'],
+    drop_content=[
+        'embed', 'iframe', 'noscript', 'object', 'script', 'style',
+        'template', 'textarea',
+    ],
+)
+
+# elements which never have an end tag
+VOID_TAGS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+])
+
+URL_ATTRIBUTES = frozenset(['href', 'src'])
+
+# browsers ignore these anywhere in a url, e.g. in "java\tscript:"
+_URL_IGNORED = re.compile(r'[\x00-\x20]+')
+
+def url_allowed(url, protocols):
+    scheme = urllib.parse.urlsplit(_URL_IGNORED.sub('', url)).scheme
+    return not scheme or scheme.lower() in protocols
+
+class _Sanitizer(html.parser.HTMLParser):
+    def __init__(self, policy):
+        super().__init__(convert_charrefs=True)
+        self.policy = policy
+        self.out = []
+        self.open = []
+        # how many of each tag are in ``open``, for a quick lookup
+        self.open_counts = {}
+        self.dropping = []
+
+    def handle_starttag(self, tag, attrs):
+        policy = self.policy
+        if self.dropping or tag in policy.drop_content:
+            if tag in policy.drop_content and tag not in VOID_TAGS:
+                self.dropping.append(tag)
+            return
+        if tag not in policy.tags:
+            return
+        allowed = policy.allowed_attributes(tag)
+        parts = [tag]
+        for name, value in attrs:
+            if name not in allowed:
+                continue
+            if value is None:
+                value = ''
+            if name in URL_ATTRIBUTES \
+                    and not url_allowed(value, policy.protocols):
+                continue
+            parts.append('%s="%s"' % (name, html.escape(value)))
+        self.out.append('<%s>' % ' '.join(parts))
+        if tag not in VOID_TAGS:
+            self.open.append(tag)
+            self.open_counts[tag] = self.open_counts.get(tag, 0) + 1
+
+    def handle_endtag(self, tag):
+        if self.dropping:
+            if tag == self.dropping[-1]:
+                self.dropping.pop()
+            return
+        if not self.open_counts.get(tag):
+            return
+        # close whatever was left open inside ``tag`` too
+        while True:
+            name = self.open.pop()
+            self.open_counts[name] -= 1
+            self.out.append('</%s>' % name)
+            if name == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.out.append(html.escape(data, quote=False))
+
+    def result(self):
+        self.close()
+        self.out.extend('</%s>' % tag for tag in reversed(self.open))
+        self.open = []
+        self.open_counts = {}
+        return ''.join(self.out)
+
+def sanitize(body, policy=POLICY):
+    """ Return ``body`` with everything ``policy`` does not allow removed.
+    """
+    parser = _Sanitizer(policy)
+    parser.feed(body)
+    return parser.result()
+
+def cached_sanitize(body, key, cache=None, policy=POLICY):
+    """ Return ``sanitize(body, policy)``, remembered in ``cache``.
+
+    ``key`` must identify ``body`` for good, e.g. a page's uri and
+    version; the policy's version is added to it.
+    """
+    if cache is None:
+        return sanitize(body, policy)
+    key += (policy.version,)
+    clean = cache.get(key)
+    if clean is None:
+        clean = sanitize(body, policy)
+        cache.set(key, clean)
+    return clean
+
+def sanitized_body(page, policy=POLICY, cache=None):
+    """ Return the body of ``page`` as ``policy`` allows it.
+
+    Only a page stored before ``policy`` was introduced, and not yet
+    reached by the :class:`Resanitizer`, is cleaned on the spot, and only
+    once per version of the page if a ``cache`` is given.
+    """
+    if page.sanitized >= policy.version:
+        return page.body
+    return cached_sanitize(
+        page.body, (page.uri, page.version), cache, policy)
+
+class Resanitizer(object):
+    """ Clean again the stored bodies of pages sanitized with an older
+    policy, or never.
+
+    Pages are read ``batch_size`` at a time in uri order. A page is only
+    replaced if it was not edited in the meantime, so the pass never
+    undoes an edit; an edited page was sanitized by its edit anyway. The
+    replacement goes through ``move`` and so becomes a new revision.
+    ``pause`` seconds are slept between batches to leave the store to the
+    requests being served.
+    """
+    def __init__(self, store, page_factory, policy=POLICY, batch_size=100,
+                 pause=0.01, on_write=None):
+        self.store = store
+        self.page_factory = page_factory
+        self.policy = policy
+        self.batch_size = batch_size
+        self.pause = pause
+        self.on_write = on_write
+        self.checked = 0
+        self.rewritten = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run(self):
+        """ Make one pass over the store and return the number of pages
+        rewritten."""
+        cursor = None
+        while not self._stop.is_set():
+            pages = self.store.pages.listing(cursor, self.batch_size)
+            if not pages:
+                break
+            for page in pages:
+                self.checked += 1
+                if page.sanitized < self.policy.version:
+                    self._rewrite(page)
+            cursor = pages[-1].uri
+            if self.pause:
+                time.sleep(self.pause)
+        return self.rewritten
+
+    def _rewrite(self, page):
+        clean = self.page_factory(
+            page.title, uri=page.uri, body=sanitize(page.body, self.policy),
+            owner=page.owner, sanitized=self.policy.version)
+        if self.store.pages.move(page.uri, clean,
+                                 expect_version=page.version):
+            self.rewritten += 1
+            if self.on_write is not None:
+                self.on_write(clean)
+
+    def start(self):
+        """ Run a pass in a daemon thread."""
+        self._thread = threading.Thread(
+            target=self.run, name='resanitizer', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
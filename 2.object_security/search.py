@@ -0,0 +1,175 @@
+""" An in-process inverted index over page titles and bodies.
+
+Each page gets a small integer id and every word in its title and
+(HTML-stripped) body maps to the set of ids containing it. A query walks
+the set of its rarest word and keeps the ids found in the sets of all the
+other words too. Matches are produced lazily, a batch at a time, so a
+query asking for the first few results of a common word does not pay for
+all of them.
+
+The index is built from the store when the application starts and kept
+up to date by the views which write pages. A store shared by several
+processes, i.e. SQLite, also lists the pages written since a generation
+(``changed_since``); ``refresh`` indexes those, so pages written by other
+processes are found too. Pages they removed are dropped from the index
+when a search comes across them.
+"""
+import html
+import itertools
+import re
+import threading
+
+_TAGS = re.compile(r'<[^>]*>')
+_WORDS = re.compile(r'\w+')
+
+def strip_html(text):
+    return html.unescape(_TAGS.sub(' ', text))
+
+def tokenize(text):
+    return _WORDS.findall(text.lower())
+
+def page_tokens(page):
+    return frozenset(tokenize(page.title) + tokenize(strip_html(page.body)))
+
+class SearchIndex(object):
+    # ids checked per hold of the lock while searching
+    probes_per_batch = 1024
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # the store generation up to which pages have been indexed
+        self.generation = 0
+        # bumped by every change, which a search in progress must notice
+        self._writes = 0
+        self._next_id = itertools.count()
+        self._ids = {}
+        self._uris = {}
+        self._tokens = {}
+        self._postings = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, page):
+        tokens = page_tokens(page)
+        with self._lock:
+            self._remove(page.uri)
+            self._writes += 1
+            doc = next(self._next_id)
+            self._ids[page.uri] = doc
+            self._uris[doc] = page.uri
+            self._tokens[doc] = tokens
+            for token in tokens:
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = set()
+                postings.add(doc)
+
+    def update(self, old_uri, page):
+        """ Re-index ``page`` which was previously indexed as ``old_uri``."""
+        with self._lock:
+            self._remove(old_uri)
+        self.add(page)
+
+    def remove(self, uri):
+        with self._lock:
+            self._remove(uri)
+
+    def _remove(self, uri):
+        doc = self._ids.pop(uri, None)
+        if doc is None:
+            return
+        self._writes += 1
+        del self._uris[doc]
+        for token in self._tokens.pop(doc):
+            postings = self._postings[token]
+            postings.discard(doc)
+            if not postings:
+                del self._postings[token]
+
+    def refresh(self, pages, batch_size=1000):
+        """ Index the pages written to the repository ``pages`` by other
+        processes since the last refresh."""
+        changed_since = getattr(pages, 'changed_since', None)
+        if changed_since is None:
+            return
+        generation = pages.generation()
+        if generation == self.generation:
+            return
+        with self._refresh_lock:
+            cursor = self.generation
+            if generation <= cursor:
+                return
+            while True:
+                changed = changed_since(cursor, batch_size)
+                if not changed:
+                    break
+                for page in changed:
+                    self.add(page)
+                cursor = changed[-1].version
+            self.generation = max(generation, cursor)
+
+    def search(self, query):
+        """ Find the pages containing every word of ``query``.
+
+        Returns an iterator over their uris in no particular order. The
+        matches are found as the iterator is consumed, so callers can stop
+        once they have enough results.
+        """
+        words = set(tokenize(query))
+        if not words:
+            return iter(())
+        return self._matches(words)
+
+    def _matches(self, words):
+        # the lock is only held for a bounded number of probes at a time.
+        # Between them the postings may change, which would break the
+        # iteration; the walk then starts over, skipping the ids it has
+        # already probed and the uris it has already produced.
+        probed = set()
+        seen = set()
+        docs = others = writes = None
+        while True:
+            batch = []
+            done = True
+            with self._lock:
+                if writes != self._writes:
+                    writes = self._writes
+                    sets = [self._postings.get(word) for word in words]
+                    if not all(sets):
+                        return
+                    sets.sort(key=len)
+                    docs, others = iter(sets[0]), sets[1:]
+                probes = 0
+                for doc in docs:
+                    if doc in probed:
+                        continue
+                    probed.add(doc)
+                    if all(doc in postings for postings in others):
+                        uri = self._uris[doc]
+                        if uri not in seen:
+                            seen.add(uri)
+                            batch.append(uri)
+                    probes += 1
+                    if probes == self.probes_per_batch:
+                        done = False
+                        break
+            yield from batch
+            if done:
+                return
+
+def build_index(store, batch_size=1000):
+    index = SearchIndex()
+    # pages written while the index is built are indexed again by the
+    # first refresh
+    index.generation = store.pages.generation()
+    cursor = None
+    while True:
+        pages = store.pages.listing(cursor, batch_size)
+        if not pages:
+            break
+        for page in pages:
+            index.add(page)
+        cursor = pages[-1].uri
+    return index
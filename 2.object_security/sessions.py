@@ -0,0 +1,256 @@
+""" Server-side sessions for the object-level security demo.
+
+``AuthTktAuthenticationPolicy`` verifies the signature of the auth_tkt
+cookie and calls the ``groupfinder`` on every request.
+``SessionAuthenticationPolicy`` instead gives the browser a random,
+opaque session id and keeps the userid and principals of the session on
+the server, so authenticating a request is one lookup in a session store.
+
+Two session stores are provided:
+
+- ``memory://`` keeps up to ``maxsize`` sessions in the current process.
+- ``sqlite:///path/to/file.db`` keeps sessions in a SQLite database so
+  they are shared by every process serving the application.
+
+Because the principals are remembered with the session, every session of
+a user has to be revoked when their groups change; ``revoke_user`` is
+meant to be subscribed to the user repository for that purpose.
+"""
+from collections import OrderedDict
+from collections import namedtuple
+import hashlib
+import json
+import secrets
+import threading
+import time
+
+from pyramid.interfaces import IAuthenticationPolicy
+from pyramid.security import Authenticated
+from pyramid.security import Everyone
+from webob.cookies import make_cookie
+from zope.interface import implementer
+
+from store import ConnectionPool
+
+Session = namedtuple('Session', ['userid', 'principals', 'expires'])
+
+### MEMORY BACKEND
+class MemorySessionStore(object):
+    """ Keep the ``maxsize`` most recently used sessions in memory."""
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._sessions = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, key):
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+            return session
+
+    def add(self, key, session):
+        with self._lock:
+            self._sessions[key] = session
+            self._by_user.setdefault(session.userid, set()).add(key)
+            while len(self._sessions) > self.maxsize:
+                old_key, old = self._sessions.popitem(last=False)
+                self._discard(old_key, old.userid)
+
+    def touch(self, key, expires):
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions[key] = session._replace(expires=expires)
+
+    def revoke(self, key):
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                self._discard(key, session.userid)
+
+    def revoke_user(self, userid):
+        with self._lock:
+            for key in self._by_user.pop(userid, ()):
+                self._sessions.pop(key, None)
+
+    def _discard(self, key, userid):
+        keys = self._by_user.get(userid)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[userid]
+
+    def close(self):
+        pass
+
+### SQLITE BACKEND
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    key TEXT PRIMARY KEY,
+    userid TEXT NOT NULL,
+    principals TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_userid ON sessions (userid);
+CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+'''
+
+class SQLiteSessionStore(object):
+    """ Keep sessions in a SQLite database shared between processes.
+
+    Expired sessions are deleted whenever a new session is added.
+    """
+    def __init__(self, path, clock=time.time):
+        self.pool = ConnectionPool(path)
+        self._clock = clock
+        self.pool.connection().executescript(SCHEMA)
+
+    def __len__(self):
+        conn = self.pool.connection()
+        return conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+    def get(self, key):
+        conn = self.pool.connection()
+        row = conn.execute(
+            'SELECT userid, principals, expires FROM sessions WHERE key = ?',
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        userid, principals, expires = row
+        return Session(userid, tuple(json.loads(principals)), expires)
+
+    def add(self, key, session):
+        conn = self.pool.connection()
+        with conn:
+            conn.execute('DELETE FROM sessions WHERE expires <= ?',
+                         (self._clock(),))
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions '
+                '(key, userid, principals, expires) VALUES (?, ?, ?, ?)',
+                (key, session.userid, json.dumps(list(session.principals)),
+                 session.expires),
+            )
+
+    def touch(self, key, expires):
+        conn = self.pool.connection()
+        with conn:
+            conn.execute('UPDATE sessions SET expires = ? WHERE key = ?',
+                         (expires, key))
+
+    def revoke(self, key):
+        conn = self.pool.connection()
+        with conn:
+            conn.execute('DELETE FROM sessions WHERE key = ?', (key,))
+
+    def revoke_user(self, userid):
+        conn = self.pool.connection()
+        with conn:
+            conn.execute('DELETE FROM sessions WHERE userid = ?', (userid,))
+
+    def close(self):
+        self.pool.close()
+
+def open_session_store(url, maxsize=100000):
+    if url == 'memory://':
+        return MemorySessionStore(maxsize)
+    if url.startswith('sqlite:///'):
+        return SQLiteSessionStore(url[len('sqlite:///'):])
+    raise ValueError('unsupported session store url: %r' % (url,))
+
+### AUTHENTICATION POLICY
+@implementer(IAuthenticationPolicy)
+class SessionAuthenticationPolicy(object):
+    """ Authenticate requests by a session id cookie.
+
+    ``callback`` is a ``groupfinder`` which is called once when the
+    session is created; a userid for which it returns ``None`` is not
+    given a session. Sessions expire ``timeout`` seconds after they were
+    last used. To avoid writing to the store on every request the expiry
+    is only pushed back once less than ``timeout - reissue_time`` seconds
+    remain.
+    """
+    def __init__(self, store, callback=None, cookie_name='session',
+                 timeout=3600, reissue_time=None, secure=False,
+                 clock=time.time):
+        self.store = store
+        self.callback = callback
+        self.cookie_name = cookie_name
+        self.timeout = timeout
+        if reissue_time is None:
+            reissue_time = timeout / 10
+        self.reissue_time = reissue_time
+        self.secure = secure
+        self._clock = clock
+
+    def _key(self, session_id):
+        # only a digest of the id is stored, so the contents of the store
+        # cannot be used as cookies
+        return hashlib.sha256(session_id.encode('utf-8')).hexdigest()
+
+    def _session(self, request):
+        try:
+            return request._auth_session
+        except AttributeError:
+            pass
+        session = None
+        session_id = request.cookies.get(self.cookie_name)
+        if session_id:
+            key = self._key(session_id)
+            session = self.store.get(key)
+            now = self._clock()
+            if session is not None and session.expires <= now:
+                self.store.revoke(key)
+                session = None
+            elif session is not None and \
+                    session.expires - now < self.timeout - self.reissue_time:
+                self.store.touch(key, now + self.timeout)
+        request._auth_session = session
+        return session
+
+    def unauthenticated_userid(self, request):
+        session = self._session(request)
+        if session is not None:
+            return session.userid
+
+    def authenticated_userid(self, request):
+        return self.unauthenticated_userid(request)
+
+    def effective_principals(self, request):
+        principals = [Everyone]
+        session = self._session(request)
+        if session is not None:
+            principals.append(Authenticated)
+            principals.append(session.userid)
+            principals.extend(session.principals)
+        return principals
+
+    def remember(self, request, userid, **kw):
+        principals = ()
+        if self.callback is not None:
+            principals = self.callback(userid, request)
+            if principals is None:
+                return []
+        session_id = secrets.token_urlsafe(32)
+        session = Session(
+            userid, tuple(principals), self._clock() + self.timeout)
+        self.store.add(self._key(session_id), session)
+        return [self._cookie(session_id)]
+
+    def forget(self, request):
+        session_id = request.cookies.get(self.cookie_name)
+        if session_id:
+            self.store.revoke(self._key(session_id))
+        request._auth_session = None
+        return [self._cookie('', max_age=0)]
+
+    def _cookie(self, value, max_age=None):
+        cookie = make_cookie(
+            self.cookie_name, value, max_age=max_age, httponly=True,
+            secure=self.secure, samesite='Lax')
+        return ('Set-Cookie', cookie)
@@ -0,0 +1,973 @@
+""" Storage for the demo's ``User`` and ``Page`` objects.
+
+The views never touch a backend directly. They go through a store which
+exposes a ``users`` and a ``pages`` repository. Two backends are provided:
+
+- ``memory://`` keeps everything in dictionaries in the current process.
+  This is the default and is what the demo has always done.
+
+- ``sqlite:///path/to/file.db`` keeps everything in a SQLite database
+  which may be shared by many processes serving the same application.
+
+"""
+import bisect
+import itertools
+import json
+import os
+import random
+import sqlite3
+import threading
+import uuid
+
+from bodies import BodyFile
+from revisions import FULL
+from revisions import KEYFRAME_EVERY
+from revisions import Revision
+from revisions import body_text
+from revisions import edit_revisions
+from revisions import next_revision
+from revisions import rebuild
+
+### MEMORY BACKEND
+class MemoryUserRepository(object):
+    def __init__(self, user_factory):
+        self._make = user_factory
+        self._users = {}
+        self._subscribers = []
+        self._writes = itertools.count(1)
+        self._generation = 0
+
+    def generation(self):
+        """ Return a number which changes whenever a user changes."""
+        return self._generation
+
+    def subscribe(self, callback):
+        """ Call ``callback(login)`` whenever a user is added or changed."""
+        self._subscribers.append(callback)
+
+    def _notify(self, login):
+        self._generation = next(self._writes)
+        for callback in self._subscribers:
+            callback(login)
+
+    def __getitem__(self, login):
+        return self._users[login]
+
+    def __contains__(self, login):
+        return login in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, login, default=None):
+        return self._users.get(login, default)
+
+    def items(self):
+        return sorted(self._users.items())
+
+    def logins(self):
+        return sorted(self._users)
+
+    def add(self, user):
+        self._users[user.login] = user
+        self._notify(user.login)
+
+    def set_groups(self, login, groups):
+        # replace the user rather than changing an object readers may hold
+        user = self._users[login]
+        self._users[login] = self._make(
+            user.login, password=user.password, groups=groups)
+        self._notify(login)
+
+    def add_many(self, users):
+        for user in users:
+            self.add(user)
+
+class PageSnapshot(object):
+    """ One published state of a :class:`MemoryPageRepository`.
+
+    Nothing reachable from a snapshot is modified once it is published:
+    writers copy the parts they change into a new snapshot instead.
+    """
+    __slots__ = ('shards', 'uris', 'by_owner', 'histories', 'generation')
+
+    def __init__(self, shards, uris, by_owner, histories, generation):
+        self.shards = shards
+        self.uris = uris
+        self.by_owner = by_owner
+        # uri -> tuple of revisions, sharded like the pages
+        self.histories = histories
+        self.generation = generation
+
+    def history(self, uri):
+        return self.histories[hash(uri) % len(self.histories)].get(uri)
+
+    def history_items(self):
+        for shard in self.histories:
+            for uri, history in shard.items():
+                yield uri, list(history)
+
+    def pages(self):
+        """ Yield the pages in uri order."""
+        for uri in self.uris:
+            yield self.shards[hash(uri) % len(self.shards)][uri]
+
+class _SnapshotWriter(object):
+    """ Build the snapshot following ``snapshot``, copying each shard and
+    owner index only the first time it is touched."""
+    def __init__(self, snapshot):
+        self.shards = list(snapshot.shards)
+        self.uris = list(snapshot.uris)
+        self.by_owner = dict(snapshot.by_owner)
+        self.histories = list(snapshot.histories)
+        self._copied_shards = set()
+        self._copied_owners = set()
+        self._copied_histories = set()
+        self._added = []
+
+    def shard(self, uri):
+        idx = hash(uri) % len(self.shards)
+        if idx not in self._copied_shards:
+            self.shards[idx] = dict(self.shards[idx])
+            self._copied_shards.add(idx)
+        return self.shards[idx]
+
+    def history_shard(self, uri):
+        idx = hash(uri) % len(self.histories)
+        if idx not in self._copied_histories:
+            self.histories[idx] = dict(self.histories[idx])
+            self._copied_histories.add(idx)
+        return self.histories[idx]
+
+    def history(self, uri):
+        return self.histories[hash(uri) % len(self.histories)].get(uri)
+
+    def set_history(self, uri, revisions):
+        self.history_shard(uri)[uri] = revisions
+
+    def drop_history(self, uri):
+        if self.history(uri) is not None:
+            del self.history_shard(uri)[uri]
+
+    def owned(self, owner):
+        if owner not in self._copied_owners:
+            self.by_owner[owner] = dict(self.by_owner.get(owner, ()))
+            self._copied_owners.add(owner)
+        return self.by_owner[owner]
+
+    def remove(self, uri):
+        page = self.shard(uri).pop(uri)
+        self.owned(page.owner).pop(uri)
+        del self.uris[bisect.bisect_left(self.uris, uri)]
+
+    def put(self, page):
+        shard = self.shard(page.uri)
+        old = shard.get(page.uri)
+        if old is None:
+            self._added.append(page.uri)
+        else:
+            self.owned(old.owner).pop(page.uri)
+        shard[page.uri] = page
+        self.owned(page.owner)[page.uri] = page
+
+    def publish(self, generation):
+        # inserting one uri at a time is quadratic for bulk loads
+        if len(self._added) > 16:
+            self.uris.extend(self._added)
+            self.uris.sort()
+        else:
+            for uri in self._added:
+                bisect.insort(self.uris, uri)
+        for owner in self._copied_owners:
+            if not self.by_owner[owner]:
+                del self.by_owner[owner]
+        return PageSnapshot(
+            tuple(self.shards), self.uris, self.by_owner,
+            tuple(self.histories), generation)
+
+class MemoryPageRepository(object):
+    """ A mapping of uri -> page that also indexes pages by their owner.
+
+    Pages must be added with ``add`` and renamed with ``move`` so that
+    the owner index stays in sync with the mapping.
+
+    Every write stamps the page with a new ``version`` taken from a
+    counter shared by all pages, so a ``(uri, version)`` pair identifies
+    one rendition of a page forever.
+
+    The repository is copy-on-write. Readers take no lock: they pick up
+    the current :class:`PageSnapshot` and see a consistent state, e.g. a
+    page being renamed is found under exactly one of its uris. Writers
+    are serialized, copy only the shards of the mapping they change and
+    publish the new snapshot with a single assignment. Pages must not be
+    modified after they were added; write a new ``Page`` instead.
+
+    Given a :class:`bodies.BodyFile`, the repository moves the body of
+    every page it is given to that file before publishing the page.
+
+    ``move`` records the new page as a revision, see ``revisions.py``.
+    The histories are part of the snapshots, so a renamed page and its
+    history appear under the new uri at once.
+    """
+    shard_count = 64
+    keyframe_every = KEYFRAME_EVERY
+
+    def __init__(self, bodies=None):
+        self._bodies = bodies
+        self._lock = threading.Lock()
+        self._versions = itertools.count(1)
+        self._snapshot = PageSnapshot(
+            tuple({} for i in range(self.shard_count)), [], {},
+            tuple({} for i in range(self.shard_count)), 0)
+
+    def generation(self):
+        """ Return the version of the most recent write."""
+        return self._snapshot.generation
+
+    def snapshot(self):
+        """ Return the current :class:`PageSnapshot`, which later writes
+        leave as it is."""
+        return self._snapshot
+
+    @staticmethod
+    def _lookup(snapshot, uri):
+        return snapshot.shards[hash(uri) % len(snapshot.shards)].get(uri)
+
+    def __getitem__(self, uri):
+        page = self._lookup(self._snapshot, uri)
+        if page is None:
+            raise KeyError(uri)
+        return page
+
+    def __contains__(self, uri):
+        return self._lookup(self._snapshot, uri) is not None
+
+    def __len__(self):
+        return len(self._snapshot.uris)
+
+    def get(self, uri, default=None):
+        page = self._lookup(self._snapshot, uri)
+        return default if page is None else page
+
+    def get_many(self, uris):
+        """ Return a dict of the pages with the given uris which exist."""
+        snapshot = self._snapshot
+        pages = {}
+        for uri in uris:
+            page = self._lookup(snapshot, uri)
+            if page is not None:
+                pages[uri] = page
+        return pages
+
+    def all(self):
+        return self.listing()
+
+    def listing(self, after=None, limit=None):
+        """ Return up to ``limit`` pages ordered by uri, starting after the
+        uri ``after``."""
+        snapshot = self._snapshot
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(snapshot.uris, after)
+        stop = None if limit is None else start + limit
+        return [self._lookup(snapshot, uri)
+                for uri in snapshot.uris[start:stop]]
+
+    def iter_listing(self, after=None):
+        """ Return an iterator over the pages ordered by uri, starting
+        after the uri ``after``, all as they were when it was called."""
+        snapshot = self._snapshot
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(snapshot.uris, after)
+        return (self._lookup(snapshot, snapshot.uris[idx])
+                for idx in range(start, len(snapshot.uris)))
+
+    def by_owner(self, owner):
+        return list(self._snapshot.by_owner.get(owner, {}).values())
+
+    def history(self, uri):
+        """ Return the revisions of the page at ``uri``, oldest first.
+
+        The revisions' ``data`` is not meant for the caller.
+        """
+        snapshot = self._snapshot
+        history = snapshot.history(uri)
+        if history is not None:
+            return list(history)
+        page = self._lookup(snapshot, uri)
+        if page is None:
+            return []
+        return [Revision(1, page.title, page.owner, FULL)]
+
+    def revision(self, uri, number):
+        """ Return ``(revision, body)`` for a revision of the page at
+        ``uri``, or ``None`` if there is no such revision."""
+        snapshot = self._snapshot
+        history = snapshot.history(uri)
+        if history is None:
+            page = self._lookup(snapshot, uri)
+            if page is None or number != 1:
+                return None
+            return Revision(1, page.title, page.owner, FULL), page.body
+        if not 1 <= number <= len(history):
+            return None
+        start = number - 1
+        while history[start].kind != FULL:
+            start -= 1
+        return history[number - 1], rebuild(history[start:number])
+
+    def histories(self):
+        """ Yield ``(uri, revisions)`` for every stored history."""
+        return self._snapshot.history_items()
+
+    def load_histories(self, histories):
+        """ Replace the histories given as ``(uri, revisions)`` pairs, e.g.
+        from a snapshot, all in one write."""
+        histories = [
+            (uri, tuple(self._keep(revision) for revision in revisions))
+            for uri, revisions in histories]
+        with self._lock:
+            writer = _SnapshotWriter(self._snapshot)
+            for uri, revisions in histories:
+                writer.set_history(uri, revisions)
+            self._snapshot = writer.publish(self._snapshot.generation)
+
+    def _keep(self, revision):
+        if self._bodies is not None and revision.kind == FULL:
+            revision.data = self._bodies.append(body_text(revision.data))
+        return revision
+
+    def _record(self, snapshot, old_uri, page):
+        """ Return ``(old_page, old_history, history)``: the page at
+        ``old_uri`` in ``snapshot``, its stored history and the history
+        recording that ``page`` replaced it."""
+        old_page = self._lookup(snapshot, old_uri)
+        old_history = snapshot.history(old_uri)
+        if old_page is None:
+            return old_page, old_history, None
+        history = old_history or ()
+        history += tuple(
+            self._keep(revision) for revision in edit_revisions(
+                history, old_page, page, self.keyframe_every))
+        return old_page, old_history, history
+
+    def _write(self, pages, old_uri=None, expect_version=None):
+        if self._bodies is not None:
+            for page in pages:
+                page.body = self._bodies.append(page.body)
+        while True:
+            # an edit's revision is worked out before taking the lock, as
+            # diffing large bodies would hold up every other writer
+            if old_uri is not None:
+                old_page, old_history, history = self._record(
+                    self._snapshot, old_uri, pages[0])
+            with self._lock:
+                snapshot = self._snapshot
+                if old_uri is not None:
+                    current = self._lookup(snapshot, old_uri)
+                    if expect_version is not None and (
+                            current is None
+                            or current.version != expect_version):
+                        return False
+                    if current is None:
+                        # another writer removed or renamed it
+                        raise KeyError(old_uri)
+                    if current is not old_page \
+                            or snapshot.history(old_uri) is not old_history:
+                        # another writer got there first, start over
+                        continue
+                writer = _SnapshotWriter(snapshot)
+                if old_uri is not None:
+                    writer.remove(old_uri)
+                    writer.drop_history(old_uri)
+                    writer.set_history(pages[0].uri, history)
+                else:
+                    # an add replaces a page along with its history
+                    for page in pages:
+                        writer.drop_history(page.uri)
+                version = snapshot.generation
+                for page in pages:
+                    page.version = version = next(self._versions)
+                    writer.put(page)
+                self._snapshot = writer.publish(version)
+            return True
+
+    def add(self, page):
+        self._write((page,))
+
+    def add_many(self, pages):
+        self._write(list(pages))
+
+    def move(self, old_uri, page, expect_version=None):
+        """ Replace the page at ``old_uri`` with ``page``.
+
+        With ``expect_version`` the page is only replaced if its version
+        still is ``expect_version``. Returns whether it was replaced.
+        Raises ``KeyError`` if there is no page at ``old_uri`` and no
+        ``expect_version``.
+        """
+        return self._write((page,), old_uri, expect_version)
+
+class MemoryStore(object):
+    def __init__(self, user_factory, page_factory, body_dir=None):
+        # distinguishes the generations of this store from those of a
+        # store created by an earlier run
+        self.ident = uuid.uuid4().hex
+        self.bodies = BodyFile(body_dir) if body_dir else None
+        self.users = MemoryUserRepository(user_factory)
+        self.pages = MemoryPageRepository(self.bodies)
+
+    def seed(self, users, pages):
+        """ Add ``users`` and ``pages`` unless the store has users already.
+
+        Several processes sharing the store may all call this when they
+        start; the data is only added once. Returns whether it was added.
+        """
+        if len(self.users):
+            return False
+        self.users.add_many(users)
+        self.pages.add_many(pages)
+        return True
+
+    def close(self):
+        if self.bodies is not None:
+            self.bodies.close()
+
+### SQLITE BACKEND
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    login TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    groups TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    uri TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    sanitized INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS pages_owner ON pages (owner, uri);
+CREATE TABLE IF NOT EXISTS revisions (
+    uri TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (uri, number)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('pages', 0);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('users', 0);
+'''
+
+# columns added to existing databases by later versions of the demo
+MIGRATIONS = [
+    ('pages', 'version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('pages', 'sanitized', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+# indexes on migrated columns, created once the columns exist
+INDEXES = '''
+CREATE INDEX IF NOT EXISTS pages_version ON pages (version);
+'''
+
+def _migrate(conn):
+    for table, column, decl in MIGRATIONS:
+        columns = [row[1] for row in conn.execute(
+            'PRAGMA table_info(%s)' % table)]
+        if column not in columns:
+            conn.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                table, column, decl))
+
+class ConnectionPool(object):
+    """ Hand out one SQLite connection per thread.
+
+    Connections are reopened after a fork so that worker processes never
+    share a connection with their parent.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # created in another thread which still owns it
+                pass
+        self._local = threading.local()
+
+class SQLiteUserRepository(object):
+    def __init__(self, pool, user_factory):
+        self._pool = pool
+        self._make = user_factory
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """ Call ``callback(login)`` whenever a user is added or changed.
+
+        Only changes made by this process are reported.
+        """
+        self._subscribers.append(callback)
+
+    def _notify(self, login):
+        for callback in self._subscribers:
+            callback(login)
+
+    def generation(self):
+        """ Return a number which changes whenever any process changes a
+        user."""
+        conn = self._pool.connection()
+        return conn.execute(
+            "SELECT value FROM counters WHERE name = 'users'").fetchone()[0]
+
+    def _bump(self, conn):
+        conn.execute(
+            "UPDATE counters SET value = value + 1 WHERE name = 'users'")
+
+    def _load(self, row):
+        login, password, groups = row
+        return self._make(login, password=password, groups=json.loads(groups))
+
+    def __getitem__(self, login):
+        user = self.get(login)
+        if user is None:
+            raise KeyError(login)
+        return user
+
+    def __contains__(self, login):
+        return self.get(login) is not None
+
+    def __len__(self):
+        conn = self._pool.connection()
+        return conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def get(self, login, default=None):
+        conn = self._pool.connection()
+        row = conn.execute(
+            'SELECT login, password, groups FROM users WHERE login = ?',
+            (login,),
+        ).fetchone()
+        if row is None:
+            return default
+        return self._load(row)
+
+    def items(self):
+        conn = self._pool.connection()
+        rows = conn.execute(
+            'SELECT login, password, groups FROM users ORDER BY login')
+        return [(row[0], self._load(row)) for row in rows]
+
+    def logins(self):
+        conn = self._pool.connection()
+        rows = conn.execute('SELECT login FROM users ORDER BY login')
+        return [row[0] for row in rows]
+
+    def add(self, user):
+        conn = self._pool.connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO users (login, password, groups) '
+                'VALUES (?, ?, ?)',
+                (user.login, user.password, json.dumps(user.groups)),
+            )
+            self._bump(conn)
+        self._notify(user.login)
+
+    def add_many(self, users):
+        users = list(users)
+        conn = self._pool.connection()
+        with conn:
+            self._insert_many(conn, users)
+        for user in users:
+            self._notify(user.login)
+
+    def _insert_many(self, conn, users):
+        conn.executemany(
+            'INSERT OR REPLACE INTO users (login, password, groups) '
+            'VALUES (?, ?, ?)',
+            [(u.login, u.password, json.dumps(u.groups)) for u in users],
+        )
+        self._bump(conn)
+
+    def set_groups(self, login, groups):
+        conn = self._pool.connection()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE users SET groups = ? WHERE login = ?',
+                (json.dumps(list(groups)), login),
+            )
+            self._bump(conn)
+        if not cursor.rowcount:
+            raise KeyError(login)
+        self._notify(login)
+
+class SQLitePageRepository(object):
+    """ Pages in SQLite, with their revisions in the ``revisions`` table.
+
+    A keyframe's ``data`` column holds the body, a delta's the delta as
+    JSON.
+    """
+    keyframe_every = KEYFRAME_EVERY
+
+    def __init__(self, pool, page_factory):
+        self._pool = pool
+        self._make = page_factory
+
+    def _load(self, row):
+        uri, title, body, owner, version, sanitized = row
+        page = self._make(title, uri=uri, body=body, owner=owner,
+                          sanitized=sanitized)
+        page.version = version
+        return page
+
+    def _query(self, where='', params=()):
+        conn = self._pool.connection()
+        return conn.execute(
+            'SELECT uri, title, body, owner, version, sanitized FROM pages '
+            + where, params)
+
+    def generation(self):
+        """ Return the version of the most recent write by any process."""
+        conn = self._pool.connection()
+        return conn.execute(
+            "SELECT value FROM counters WHERE name = 'pages'").fetchone()[0]
+
+    def _next_versions(self, conn, count):
+        conn.execute(
+            "UPDATE counters SET value = value + ? WHERE name = 'pages'",
+            (count,))
+        last = conn.execute(
+            "SELECT value FROM counters WHERE name = 'pages'").fetchone()[0]
+        return range(last - count + 1, last + 1)
+
+    def __getitem__(self, uri):
+        page = self.get(uri)
+        if page is None:
+            raise KeyError(uri)
+        return page
+
+    def __contains__(self, uri):
+        return self.get(uri) is not None
+
+    def __len__(self):
+        conn = self._pool.connection()
+        return conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def get(self, uri, default=None):
+        row = self._query('WHERE uri = ?', (uri,)).fetchone()
+        if row is None:
+            return default
+        return self._load(row)
+
+    def get_many(self, uris):
+        """ Return a dict of the pages with the given uris which exist."""
+        uris = list(set(uris))
+        pages = {}
+        # stay below SQLite's limit on the number of bound parameters
+        for start in range(0, len(uris), 500):
+            batch = uris[start:start + 500]
+            where = 'WHERE uri IN (%s)' % ', '.join('?' * len(batch))
+            for row in self._query(where, batch):
+                page = self._load(row)
+                pages[page.uri] = page
+        return pages
+
+    def all(self):
+        return [self._load(row) for row in self._query('ORDER BY uri')]
+
+    def listing(self, after=None, limit=None):
+        where, params = 'ORDER BY uri', ()
+        if after is not None:
+            where, params = 'WHERE uri > ? ORDER BY uri', (after,)
+        if limit is not None:
+            where, params = where + ' LIMIT ?', params + (limit,)
+        return [self._load(row) for row in self._query(where, params)]
+
+    def iter_listing(self, after=None):
+        """ Return an iterator over the pages ordered by uri, starting
+        after the uri ``after``, all as they were when it was called."""
+        # a connection of its own, as its read transaction stays open
+        # for as long as the caller takes and must not hold up the
+        # thread's other work; it is only ever used by one thread at once
+        conn = sqlite3.connect(
+            self._pool.path, timeout=30, check_same_thread=False)
+        conn.execute('BEGIN')
+        where, params = 'ORDER BY uri', ()
+        if after is not None:
+            where, params = 'WHERE uri > ? ORDER BY uri', (after,)
+        # the snapshot is taken by the first step, which happens here
+        rows = conn.execute(
+            'SELECT uri, title, body, owner, version, sanitized FROM pages '
+            + where, params)
+        return self._iter_rows(conn, rows)
+
+    def _iter_rows(self, conn, rows):
+        try:
+            for row in rows:
+                yield self._load(row)
+        finally:
+            conn.close()
+
+    def by_owner(self, owner):
+        rows = self._query('WHERE owner = ? ORDER BY uri', (owner,))
+        return [self._load(row) for row in rows]
+
+    def changed_since(self, generation, limit=None):
+        """ Return up to ``limit`` pages written by any process after
+        ``generation``, ordered by version.
+
+        Pages are written with increasing versions, so passing the version
+        of the last page returned gets the next batch. Pages which were
+        removed are not listed.
+        """
+        where, params = 'WHERE version > ? ORDER BY version', (generation,)
+        if limit is not None:
+            where, params = where + ' LIMIT ?', params + (limit,)
+        return [self._load(row) for row in self._query(where, params)]
+
+    def history(self, uri):
+        """ Return the revisions of the page at ``uri``, oldest first,
+        without their ``data``."""
+        conn = self._pool.connection()
+        rows = conn.execute(
+            'SELECT number, title, owner, kind FROM revisions '
+            'WHERE uri = ? ORDER BY number', (uri,)).fetchall()
+        if rows:
+            return [Revision(*row) for row in rows]
+        page = self.get(uri)
+        if page is None:
+            return []
+        return [Revision(1, page.title, page.owner, FULL)]
+
+    def revision(self, uri, number):
+        """ Return ``(revision, body)`` for a revision of the page at
+        ``uri``, or ``None`` if there is no such revision."""
+        conn = self._pool.connection()
+        rows = conn.execute(
+            'SELECT number, title, owner, kind, data FROM revisions '
+            'WHERE uri = ? AND number <= ? AND number >= ('
+            '    SELECT max(number) FROM revisions'
+            '    WHERE uri = ? AND number <= ? AND kind = ?'
+            ') ORDER BY number',
+            (uri, number, uri, number, FULL)).fetchall()
+        if not rows:
+            page = self.get(uri)
+            if page is None or number != 1 or conn.execute(
+                    'SELECT 1 FROM revisions WHERE uri = ?',
+                    (uri,)).fetchone():
+                return None
+            return Revision(1, page.title, page.owner, FULL), page.body
+        revisions = [self._load_revision(row) for row in rows]
+        if revisions[-1].number != number:
+            return None
+        return revisions[-1], rebuild(revisions)
+
+    def _load_revision(self, row):
+        number, title, owner, kind, data = row
+        if kind != FULL:
+            data = json.loads(data)
+        return Revision(number, title, owner, kind, data)
+
+    def _record(self, conn, old_uri, page):
+        """ Return ``(version, revisions)``: the version of the page at
+        ``old_uri`` and the revisions recording that ``page`` replaced
+        it, or ``None`` if there is no such page."""
+        with conn:
+            # one read transaction, so the page and its history agree
+            conn.execute('BEGIN')
+            row = conn.execute(
+                'SELECT version, title, body, owner FROM pages '
+                'WHERE uri = ?', (old_uri,)).fetchone()
+            if row is None:
+                return None
+            number, keyframe = conn.execute(
+                'SELECT max(number), max(CASE kind WHEN ? THEN number END) '
+                'FROM revisions WHERE uri = ?', (FULL, old_uri)).fetchone()
+        version, title, body, owner = row
+        revisions = []
+        if number is None:
+            # the first edit keeps the page as it was as revision 1
+            revisions.append(Revision(1, title, owner, FULL, body))
+            number = keyframe = 1
+        revisions.append(next_revision(
+            number + 1, page, body, number - keyframe, self.keyframe_every))
+        return version, revisions
+
+    def _insert_revision(self, conn, uri, revision):
+        data = revision.data
+        if revision.kind != FULL:
+            data = json.dumps(data)
+        conn.execute(
+            'INSERT INTO revisions (uri, number, title, owner, kind, data) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (uri, revision.number, revision.title, revision.owner,
+             revision.kind, data))
+
+    def add(self, page):
+        conn = self._pool.connection()
+        with conn:
+            self._insert(conn, page)
+            # an add replaces a page along with its history
+            conn.execute('DELETE FROM revisions WHERE uri = ?', (page.uri,))
+
+    def add_many(self, pages):
+        conn = self._pool.connection()
+        with conn:
+            self._insert_many(conn, list(pages))
+
+    def _insert_many(self, conn, pages):
+        for page, version in zip(
+                pages, self._next_versions(conn, len(pages))):
+            page.version = version
+        conn.executemany(
+            'INSERT OR REPLACE INTO pages '
+            '(uri, title, body, owner, version, sanitized) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(p.uri, p.title, p.body, p.owner, p.version, p.sanitized)
+             for p in pages],
+        )
+        conn.executemany('DELETE FROM revisions WHERE uri = ?',
+                         [(p.uri,) for p in pages])
+
+    def move(self, old_uri, page, expect_version=None):
+        """ Replace the page at ``old_uri`` with ``page``.
+
+        With ``expect_version`` the page is only replaced if its version
+        still is ``expect_version``. Returns whether it was replaced.
+        Raises ``KeyError`` if there is no page at ``old_uri`` and no
+        ``expect_version``.
+        """
+        conn = self._pool.connection()
+        while True:
+            # the revision is worked out before the write transaction, as
+            # diffing large bodies would hold up every other writer
+            edit = self._record(conn, old_uri, page)
+            with conn:
+                # bumping the version takes the write lock, so the old
+                # page cannot change between being checked and replaced
+                version = self._next_versions(conn, 1)[0]
+                row = conn.execute(
+                    'SELECT version FROM pages WHERE uri = ?',
+                    (old_uri,)).fetchone()
+                current = None if row is None else row[0]
+                if expect_version is not None \
+                        and current != expect_version:
+                    conn.rollback()
+                    return False
+                if current is None:
+                    # another writer removed or renamed it
+                    raise KeyError(old_uri)
+                if edit is None or current != edit[0]:
+                    # another writer got there first, start over
+                    conn.rollback()
+                    continue
+                if page.uri != old_uri:
+                    conn.execute('DELETE FROM revisions WHERE uri = ?',
+                                 (page.uri,))
+                    conn.execute(
+                        'UPDATE revisions SET uri = ? WHERE uri = ?',
+                        (page.uri, old_uri))
+                for revision in edit[1]:
+                    self._insert_revision(conn, page.uri, revision)
+                conn.execute('DELETE FROM pages WHERE uri = ?', (old_uri,))
+                self._insert(conn, page, version)
+            return True
+
+    def _insert(self, conn, page, version=None):
+        if version is None:
+            version = self._next_versions(conn, 1)[0]
+        page.version = version
+        conn.execute(
+            'INSERT OR REPLACE INTO pages '
+            '(uri, title, body, owner, version, sanitized) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (page.uri, page.title, page.body, page.owner, page.version,
+             page.sanitized),
+        )
+
+class SQLiteStore(object):
+    def __init__(self, path, user_factory, page_factory):
+        self.pool = ConnectionPool(path)
+        conn = self.pool.connection()
+        conn.executescript(SCHEMA)
+        with conn:
+            _migrate(conn)
+        conn.executescript(INDEXES)
+        with conn:
+            # a random id chosen when the database is created, so that a
+            # recreated database does not reuse the generations of its
+            # predecessor
+            conn.execute(
+                "INSERT OR IGNORE INTO counters (name, value) "
+                "VALUES ('ident', ?)", (random.getrandbits(62),))
+        self.ident = '%x' % conn.execute(
+            "SELECT value FROM counters WHERE name = 'ident'").fetchone()[0]
+        self.users = SQLiteUserRepository(self.pool, user_factory)
+        self.pages = SQLitePageRepository(self.pool, page_factory)
+
+    def seed(self, users, pages):
+        """ Add ``users`` and ``pages`` unless the store has users already.
+
+        Several processes sharing the store may all call this when they
+        start; the data is only added once. Returns whether it was added.
+        """
+        users = list(users)
+        conn = self.pool.connection()
+        with conn:
+            # taking the write lock first makes the check and the inserts
+            # one step for the other processes
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+                return False
+            self.users._insert_many(conn, users)
+            self.pages._insert_many(conn, list(pages))
+        for user in users:
+            self.users._notify(user.login)
+        return True
+
+    def close(self):
+        self.pool.close()
+
+def open_store(url, user_factory, page_factory, body_dir=None):
+    """ Open the store described by ``url``.
+
+    ``user_factory`` and ``page_factory`` are used by backends which need
+    to rebuild model objects from their stored representation.
+
+    ``body_dir`` makes the memory store keep page bodies in a
+    memory-mapped file in that directory, see ``bodies.py``.
+    """
+    if url == 'memory://':
+        return MemoryStore(user_factory, page_factory, body_dir)
+    if body_dir:
+        raise ValueError('page bodies can only be kept in a file by the '
+                         'memory:// store')
+    if url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        return SQLiteStore(path, user_factory, page_factory)
+    raise ValueError('unsupported store url: %r' % (url,))
@@ -0,0 +1,11 @@
+<%inherit file='base.mako' />
+
+<p><a href="${ request.route_url('page', title=page.uri) }">Back to the page</a></p>
+
+<h1>History of ${ page.title }</h1>
+% for revision in revisions:
+<p>
+    <a href="${ request.route_url('page_revision', title=page.uri, n=revision.number) }">Revision ${ revision.number }</a>:
+    ${ revision.title }, owned by ${ revision.owner }
+</p>
+% endfor
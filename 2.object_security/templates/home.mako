@@ -11,6 +11,7 @@
 <p>Create a page <a href="${ request.route_url('create_page') }">here</a></p>
 
 <p><a href="${ request.route_url('pages') }">All Pages</a></p>
+<p><a href="${ request.route_url('search') }">Search Pages</a></p>
 <p><a href="${ request.route_url('users') }">All Users</a></p>
 
 <h2>Your Pages</h2>
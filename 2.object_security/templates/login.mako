@@ -1,6 +1,8 @@
 <%inherit file='base.mako' />
 
-% if failed_attempt:
+% if throttled:
+<p><font color="red">Too many login attempts, please wait and try again.</font></p>
+% elif failed_attempt:
 <p><font color="red">Invalid credentials, try again.</font></p>
 % endif
 <form method="post" action="${ request.path }">
@@ -17,6 +19,6 @@
 </form>
 
 <h3>Valid login / password combinations:</h3>
-% for k, v in users.items():
-<p>${ k } / ${ v.password }</p>
+% for k, v in users:
+<p>${ k } / ${ v }</p>
 % endfor
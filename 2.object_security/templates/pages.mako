@@ -4,6 +4,22 @@
 <p>Create a page <a href="${ request.route_url('create_page') }">here</a></p>
 
 <h1>All Pages</h1>
+% if pages is None:
+${ stream_marker | n }
+% else:
+${ page_list(pages, editable) }
+% if next_url:
+<p><a href="${ next_url }">Next</a></p>
+% endif
+% endif
+
+<%def name="page_list(pages, editable)">
 % for page in pages:
-<p><a href="${ request.route_url('page', title=page.uri) }">${ page.title }</a></p>
+<p>
+    <a href="${ request.route_url('page', title=page.uri) }">${ page.title }</a>
+    % if page.uri in editable:
+    (<a href="${ request.route_url('edit_page', title=page.uri) }">edit</a>)
+    % endif
+</p>
 % endfor
+</%def>
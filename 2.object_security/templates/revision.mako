@@ -0,0 +1,15 @@
+<%inherit file='base.mako' />
+
+<p><a href="${ request.route_url('page_history', title=page.uri) }">History</a>
+% if revision.number == latest:
+(this is the current revision)
+% endif
+</p>
+
+<h1>${ revision.title }</h1>
+<p>Revision ${ revision.number } of ${ latest }</p>
+<p>Owner: <a href="${ request.route_url('user', login=revision.owner) }">${ revision.owner }</a></p>
+<p>Body:</p>
+<div style="margin-left: 4em;">
+    ${ body | n }
+</div>
@@ -0,0 +1,22 @@
+<%inherit file='base.mako' />
+
+<p><a href="${ request.route_url('home') }">Home</a></p>
+
+<h1>Search Pages</h1>
+<form method="get" action="${ request.route_url('search') }">
+    <input type="text" name="q" value="${ q }"/>
+    <input type="submit" value="Search"/>
+</form>
+
+% if q:
+% if pages:
+% for page in pages:
+<p><a href="${ request.route_url('page', title=page.uri) }">${ page.title }</a></p>
+% endfor
+% if truncated:
+<p>Only the first ${ len(pages) } results are shown.</p>
+% endif
+% else:
+<p>No pages matched.</p>
+% endif
+% endif
@@ -4,7 +4,6 @@
 
 <h1>User Information</h1>
 <p>Login: ${ user.login }</p>
-<p>Password: ${ user.password }</p>
 <p>Groups: ${ ', '.join(user.groups) }</p>
 <p>Pages:</p>
 <div style="margin-left: 4em;">
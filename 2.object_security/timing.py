@@ -0,0 +1,241 @@
+""" Per-request phase timings.
+
+A ``RequestTimer`` is attached to every request by the timing tween in
+``demo.py``. Code interested in a phase starts and stops it on the timer;
+phases nest and each one is charged only for its own time, so the time
+spent in the ``groupfinder`` is not also counted as authentication.
+
+The phases recorded by the demo are:
+
+traversal
+    Route matching, the root factory and ``__getitem__`` calls up to the
+    point where the context is found.
+authn
+    The authentication policy, e.g. parsing the auth_tkt cookie.
+groupfinder
+    The authentication policy's callback.
+authz
+    The authorization policy's ACL evaluation.
+view
+    The view callable itself.
+render
+    The renderer, from being handed the view's result until the body is
+    rendered.
+
+Finished timers are aggregated per route into ``TimingStats``.
+"""
+import bisect
+import threading
+import time
+
+from pyramid.interfaces import IAuthenticationPolicy
+from pyramid.interfaces import IAuthorizationPolicy
+from pyramid.interfaces import IRendererFactory
+from zope.interface import implementer
+
+class RequestTimer(object):
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self._stack = []
+        self.totals = {}
+        self.started = clock()
+        self.finished = False
+        self.total = None
+
+    def start(self, phase):
+        if not self.finished:
+            self._stack.append([phase, self._clock(), 0.0])
+
+    def stop(self):
+        if self.finished or not self._stack:
+            return
+        phase, started, children = self._stack.pop()
+        elapsed = self._clock() - started
+        self.totals[phase] = self.totals.get(phase, 0.0) + elapsed - children
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def finish(self):
+        while self._stack:
+            self.stop()
+        if not self.finished:
+            self.total = self._clock() - self.started
+            self.finished = True
+
+    def server_timing(self):
+        """ Format the totals for a ``Server-Timing`` header."""
+        entries = ['%s;dur=%.3f' % (phase, secs * 1000)
+                   for phase, secs in sorted(self.totals.items())]
+        if self.total is not None:
+            entries.append('total;dur=%.3f' % (self.total * 1000))
+        return ', '.join(entries)
+
+def timed(phase, fn):
+    """ Wrap ``fn(..., request)`` so calls are charged to ``phase``."""
+    def wrapper(*args):
+        timer = getattr(args[-1], 'timer', None)
+        if timer is None:
+            return fn(*args)
+        timer.start(phase)
+        try:
+            return fn(*args)
+        finally:
+            timer.stop()
+    return wrapper
+
+@implementer(IAuthenticationPolicy)
+class TimedAuthenticationPolicy(object):
+    """ Charge every call into ``policy`` to the ``authn`` phase."""
+    def __init__(self, policy):
+        self.policy = policy
+        for name in ('authenticated_userid', 'unauthenticated_userid',
+                     'effective_principals', 'remember', 'forget'):
+            setattr(self, name, self._wrap(getattr(policy, name)))
+
+    def _wrap(self, method):
+        def wrapper(request, *args, **kw):
+            timer = getattr(request, 'timer', None)
+            if timer is None:
+                return method(request, *args, **kw)
+            timer.start('authn')
+            try:
+                return method(request, *args, **kw)
+            finally:
+                timer.stop()
+        return wrapper
+
+@implementer(IAuthorizationPolicy)
+class TimedAuthorizationPolicy(object):
+    """ Charge ACL evaluation to the ``authz`` phase.
+
+    The authorization policy is not given the request, so the timer of
+    the current request is found through Pyramid's threadlocals.
+    """
+    def __init__(self, policy, get_request):
+        self.policy = policy
+        self._get_request = get_request
+
+    def _timer(self):
+        return getattr(self._get_request(), 'timer', None)
+
+    def permits(self, context, principals, permission):
+        timer = self._timer()
+        if timer is None:
+            return self.policy.permits(context, principals, permission)
+        timer.start('authz')
+        try:
+            return self.policy.permits(context, principals, permission)
+        finally:
+            timer.stop()
+
+    def filter_permitted(self, contexts, principals, permission):
+        timer = self._timer()
+        if timer is None:
+            return self.policy.filter_permitted(
+                contexts, principals, permission)
+        timer.start('authz')
+        try:
+            return self.policy.filter_permitted(
+                contexts, principals, permission)
+        finally:
+            timer.stop()
+
+    def principals_allowed_by_permission(self, context, permission):
+        return self.policy.principals_allowed_by_permission(
+            context, permission)
+
+class TimedRendererFactory(object):
+    """ Charge the renderers made by ``factory`` to the ``render`` phase."""
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __call__(self, info):
+        renderer = self.factory(info)
+
+        def timed_renderer(value, system):
+            timer = getattr(system.get('request'), 'timer', None)
+            if timer is None:
+                return renderer(value, system)
+            timer.start('render')
+            try:
+                return renderer(value, system)
+            finally:
+                timer.stop()
+        return timed_renderer
+
+def time_renderers(registry):
+    """ Wrap every renderer factory of a committed ``registry`` in a
+    :class:`TimedRendererFactory`."""
+    for name, factory in list(registry.getUtilitiesFor(IRendererFactory)):
+        registry.registerUtility(
+            TimedRendererFactory(factory), IRendererFactory, name=name)
+
+# bucket upper bounds from 10us doubling up to ~80s
+BUCKETS = tuple(1e-5 * 2 ** i for i in range(24))
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, pct):
+        """ Return the upper bound of the bucket holding ``pct``."""
+        if not self.count:
+            return 0.0
+        target = pct / 100.0 * self.count
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                break
+        return BUCKETS[min(idx, len(BUCKETS) - 1)]
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total * 1000 / self.count if self.count else 0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p90_ms': self.percentile(90) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'buckets': [
+                [BUCKETS[idx] * 1000 if idx < len(BUCKETS) else None, n]
+                for idx, n in enumerate(self.counts) if n
+            ],
+        }
+
+class TimingStats(object):
+    """ Histograms of phase timings per route, shared by all threads."""
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, timer):
+        phases = dict(timer.totals)
+        phases['total'] = timer.total
+        with self._lock:
+            histograms = self._routes.setdefault(route, {})
+            for phase, secs in phases.items():
+                hist = histograms.get(phase)
+                if hist is None:
+                    hist = histograms[phase] = Histogram()
+                hist.add(secs)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                route or '<no route>': {
+                    phase: hist.as_dict() for phase, hist in phases.items()
+                }
+                for route, phases in self._routes.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
@@ -0,0 +1,163 @@
+""" Measure how long restoring the journaled memory store takes.
+
+For every journal size a synthetic journal is written in which a quarter
+of the records create pages and the rest edit them, one edit in eight
+renaming its page. The benchmark then reports the time to replay the
+journal into an empty memory store, to compact it into a snapshot and to
+start again from that snapshot alone.
+
+It then edits and renames pages of the restored store and compacts
+again, to check that a restart after a crash between writing that
+snapshot and deleting the compacted journal, which is then still around,
+restores the same pages and histories as the snapshot alone.
+
+Usage::
+
+    python benchmarks/bench_journal.py --sizes 10000,100000,1000000
+
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from demo_loader import load_demo  # noqa: E402
+
+def write_journal(path, n_records, body_size, seed=0):
+    rng = random.Random(seed)
+    n_pages = max(1, n_records // 4)
+    lines = ['%-49s\n' % ('line %d' % i) for i in range(body_size // 50)]
+    uris = []
+    with open(path, 'w') as fp:
+        for i in range(n_records):
+            record = {'op': 'page', 'owner': 'user%d' % (i % 100)}
+            if i < n_pages:
+                uri = 'page-%d' % i
+                uris.append(uri)
+            else:
+                # edits change one line of the body
+                k = rng.randrange(n_pages)
+                record['old_uri'] = uri = uris[k]
+                if rng.randrange(8) == 0:
+                    uri = uris[k] = 'page-%d-%d' % (k, i)
+                lines[rng.randrange(len(lines))] = 'edit %d\n' % i
+            record.update(uri=uri, title=uri, body=''.join(lines))
+            fp.write(json.dumps(record) + '\n')
+    return n_pages
+
+def edit_pages(demo, store, n_edits, seed=0):
+    rng = random.Random(seed)
+    uris = [page.uri for page in store.pages.all()]
+    for i in range(n_edits):
+        k = rng.randrange(len(uris))
+        page = store.pages[uris[k]]
+        uri = page.uri
+        if rng.randrange(4) == 0:
+            uri = uris[k] = 'page-%d-again-%d' % (k, i)
+        store.pages.move(page.uri, demo.Page(
+            uri, uri=uri, body=page.body + 'again %d\n' % i,
+            owner=page.owner))
+
+def dump(store):
+    pages = [(page.uri, page.body) for page in store.pages.all()]
+    histories = sorted(
+        (uri, [(r.number, r.title, r.owner, r.kind, r.data)
+               for r in revisions])
+        for uri, revisions in store.pages.histories())
+    return pages, histories
+
+def restore(demo, directory):
+    store = demo.open_store('memory://', demo.User, demo.Page)
+    start = time.perf_counter()
+    store = demo.open_journal(directory, store, demo.User, demo.Page,
+                              compact_every=0, fsync=False)
+    return store, time.perf_counter() - start
+
+def bench_size(demo, n_records, body_size):
+    directory = tempfile.mkdtemp(prefix='bench_journal')
+    try:
+        journal = os.path.join(directory, 'journal.jsonl')
+        n_pages = write_journal(journal, n_records, body_size)
+        journal_bytes = os.path.getsize(journal)
+
+        store, replay = restore(demo, directory)
+        assert len(store.pages) == n_pages
+        start = time.perf_counter()
+        store.journal.compact()
+        compact = time.perf_counter() - start
+        store.close()
+        snapshot_bytes = os.path.getsize(
+            os.path.join(directory, 'snapshot.jsonl'))
+
+        store, snapshot = restore(demo, directory)
+        assert len(store.pages) == n_pages
+        edit_pages(demo, store, max(1, n_records // 10))
+        # keep the journal the compaction deletes
+        shutil.copy(journal, journal + '.keep')
+        store.journal.compact()
+        store.close()
+        store, _ = restore(demo, directory)
+        expected = dump(store)
+        store.close()
+
+        # as left by a crash before the compacted journal was deleted: it
+        # ends with the record the snapshot starts with
+        with open(os.path.join(directory, 'snapshot.jsonl')) as fp:
+            compaction = fp.readline()
+        with open(journal + '.keep', 'a') as fp:
+            fp.write(compaction)
+        os.rename(journal + '.keep',
+                  os.path.join(directory, 'journal.old.jsonl'))
+        store, _ = restore(demo, directory)
+        assert dump(store) == expected, 'restart after a crash differs'
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+    return {
+        'records': n_records,
+        'pages': n_pages,
+        'journal_mb': journal_bytes / 1e6,
+        'replay_s': replay,
+        'replay_records_per_s': n_records / replay,
+        'compact_s': compact,
+        'snapshot_mb': snapshot_bytes / 1e6,
+        'snapshot_restore_s': snapshot,
+    }
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated numbers of journal records')
+    parser.add_argument('--body-size', type=int, default=500)
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args(argv[1:])
+
+    demo = load_demo('2.object_security')
+    results = [bench_size(demo, int(size), args.body_size)
+               for size in args.sizes.split(',')]
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return 0
+
+    print('%10s %9s %10s %10s %12s %10s %11s %10s' % (
+        'records', 'pages', 'journal MB', 'replay s', 'records/s',
+        'compact s', 'snapshot MB', 'restore s'))
+    for r in results:
+        print('%10d %9d %10.1f %10.3f %12.0f %10.3f %11.1f %10.3f' % (
+            r['records'], r['pages'], r['journal_mb'], r['replay_s'],
+            r['replay_records_per_s'], r['compact_s'], r['snapshot_mb'],
+            r['snapshot_restore_s']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
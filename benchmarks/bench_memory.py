@@ -0,0 +1,110 @@
+""" Measure how many bytes each page costs a worker.
+
+Pages are built the way a store loads them, with a fresh owner string for
+every page as it comes out of a database row or a journal record. The
+benchmark compares the object security demo's ``Page`` with ``DictPage``,
+the same record as it was before it gained ``__slots__`` and interned
+owners, and reports the bytes per page allocated for the records alone
+(including their strings) and after loading them into a memory store.
+
+With ``--bodies DIR`` it also measures a memory store which keeps the
+bodies in a memory-mapped file in ``DIR`` (``store.bodies``). The mapped
+file is not allocated on the heap and is not counted.
+
+Usage::
+
+    python benchmarks/bench_memory.py --pages 1000000 --body-size 0
+    python benchmarks/bench_memory.py --body-size 2000 --bodies /var/tmp
+
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from demo_loader import load_demo  # noqa: E402
+
+class DictPage(object):
+    """ ``Page`` with a ``__dict__`` and its own copy of the owner."""
+    def __init__(self, title, uri, body, owner):
+        self.title = title
+        self.uri = uri
+        self.body = body
+        self.owner = owner
+
+def make_pages(page_factory, n_pages, n_owners, body_size):
+    return [
+        page_factory('Page %d' % i, uri='Page-%d' % i,
+                     body=('%d ' % i).ljust(body_size, 'x')[:body_size],
+                     owner='user%d' % (i % n_owners))
+        for i in range(n_pages)
+    ]
+
+def traced():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+def bench_variant(demo, page_factory, args, body_dir=None):
+    tracemalloc.start()
+    try:
+        start = traced()
+        pages = make_pages(
+            page_factory, args.pages, args.owners, args.body_size)
+        records = traced() - start
+        store = demo.open_store('memory://', demo.User, demo.Page,
+                                body_dir=body_dir)
+        store.pages.add_many(pages)
+        loaded = traced() - start
+    finally:
+        tracemalloc.stop()
+    assert len(store.pages) == args.pages
+    store.close()
+    return {
+        'records_bytes_per_page': records / args.pages,
+        'store_bytes_per_page': loaded / args.pages,
+    }
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pages', type=int, default=100000)
+    parser.add_argument('--owners', type=int, default=100)
+    parser.add_argument('--body-size', type=int, default=0,
+                        help='characters in every body')
+    parser.add_argument('--bodies', metavar='DIR',
+                        help='also measure bodies kept in a file in DIR')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args(argv[1:])
+
+    demo = load_demo('2.object_security')
+    results = {
+        'dict': bench_variant(demo, DictPage, args),
+        'slots': bench_variant(demo, demo.Page, args),
+    }
+    if args.bodies:
+        results['mmap'] = bench_variant(demo, demo.Page, args, args.bodies)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return 0
+
+    print('%d pages, %d owners, %d byte bodies' % (
+        args.pages, args.owners, args.body_size))
+    print('%-8s %16s %16s' % ('record', 'records B/page', 'store B/page'))
+    for name, r in results.items():
+        print('%-8s %16.1f %16.1f' % (
+            name, r['records_bytes_per_page'], r['store_bytes_per_page']))
+    saved = results['dict']['store_bytes_per_page'] \
+        - results['slots']['store_bytes_per_page']
+    print('saved %.1f bytes per page, %.1f MB per million pages' % (
+        saved, saved))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
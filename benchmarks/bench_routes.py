@@ -0,0 +1,188 @@
+""" Measure every route of the three demos in-process.
+
+Each demo is built through its own ``main()``, filled with a synthetic data
+set and then driven with ``webob`` requests without going over the
+network, so the numbers reflect the cost of Pyramid, the security
+policies, the store and the templates only.
+
+Usage::
+
+    python benchmarks/bench_routes.py --pages 10000 --requests 2000
+
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from webob import Request
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from demo_loader import DEMOS  # noqa: E402
+from demo_loader import load_demo  # noqa: E402
+from demo_loader import make_app  # noqa: E402
+
+# route name -> (path template, whether it needs a page title or login)
+ROUTES = [
+    ('home', '/', None),
+    ('login', '/login', None),
+    ('pages', '/pages', None),
+    ('page', '/page/%s', 'page'),
+    ('edit_page', '/page/%s/edit', 'page'),
+    ('users', '/users', None),
+    ('user', '/user/%s', 'user'),
+]
+
+# try these identities in order and keep the first one allowed to view
+# the route, so that every route is measured on its success path
+IDENTITIES = [None, 'luser', 'editor', 'admin']
+
+def populate(demo, store, n_pages, n_users, seed=0):
+    rng = random.Random(seed)
+    owners = ['luser'] + ['user%d' % i for i in range(n_users)]
+    store.users.add_many(
+        demo.User(login, password=login) for login in owners[1:])
+
+    batch = []
+    titles = []
+    for i in range(n_pages):
+        title = 'Page %d' % i
+        titles.append(demo.websafe_uri(title))
+        batch.append(demo.Page(
+            title,
+            uri=titles[-1],
+            body='<p>%s</p>' % ('lorem ipsum ' * rng.randint(5, 50)),
+            owner=rng.choice(owners),
+        ))
+        if len(batch) >= 1000:
+            store.pages.add_many(batch)
+            batch = []
+    store.pages.add_many(batch)
+    # edit_page is measured as luser, make sure luser owns a page to edit
+    store.pages.add(demo.Page(
+        'luser page', uri='luser-page', body='<p>mine</p>', owner='luser'))
+    return titles, owners
+
+def login(app, who):
+    req = Request.blank('/login', POST={
+        'login': who, 'passwd': who, 'submit': 'Submit'})
+    res = req.get_response(app)
+    if res.status_int != 302:
+        raise RuntimeError('could not log in as %s: %s' % (who, res.status))
+    return '; '.join(
+        value.split(';', 1)[0]
+        for name, value in res.headerlist if name == 'Set-Cookie'
+    )
+
+def request(app, path, cookie):
+    req = Request.blank(path)
+    if cookie:
+        req.headers['Cookie'] = cookie
+    res = req.get_response(app)
+    # consume streamed bodies so their rendering is measured too
+    res.body
+    return res.status_int
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (
+        len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+def bench_demo(name, args):
+    demo = load_demo(name)
+    app = make_app(name, **{
+        'store.url': args.store,
+        # do not let the benchmark trip the login throttle
+        'auth.login.rate': '1000000',
+        'auth.login.burst': '1000000',
+        'auth.login.addr_rate': '1000000',
+        'auth.login.addr_burst': '1000000',
+    })
+    titles, owners = populate(
+        demo, app.registry.store, args.pages, args.users)
+    cookies = {None: None}
+    for who in IDENTITIES[1:]:
+        cookies[who] = login(app, who)
+
+    rng = random.Random(1)
+    results = []
+    for route, template, arg in ROUTES:
+        def path():
+            if arg == 'page':
+                if route == 'edit_page':
+                    return template % 'luser-page'
+                return template % rng.choice(titles)
+            if arg == 'user':
+                return template % rng.choice(owners)
+            return template
+
+        for who in IDENTITIES:
+            status = request(app, path(), cookies[who])
+            if status == 200:
+                break
+
+        for i in range(args.warmup):
+            request(app, path(), cookies[who])
+
+        timings = []
+        statuses = {}
+        start = time.perf_counter()
+        for i in range(args.requests):
+            p = path()
+            t0 = time.perf_counter()
+            status = request(app, p, cookies[who])
+            timings.append(time.perf_counter() - t0)
+            statuses[status] = statuses.get(status, 0) + 1
+        elapsed = time.perf_counter() - start
+        timings.sort()
+        results.append({
+            'demo': name,
+            'route': route,
+            'identity': who,
+            'requests': args.requests,
+            'statuses': statuses,
+            'rps': args.requests / elapsed,
+            'p50_ms': percentile(timings, 50) * 1000,
+            'p99_ms': percentile(timings, 99) * 1000,
+        })
+    app.registry.store.close()
+    return results
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--demo', action='append', choices=DEMOS,
+                        help='demo to run (default: all of them)')
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--store', default='memory://')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args(argv[1:])
+
+    results = []
+    for name in args.demo or DEMOS:
+        results.extend(bench_demo(name, args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print('%-18s %-10s %-7s %9s %9s %9s  %s' % (
+        'demo', 'route', 'as', 'req/s', 'p50 ms', 'p99 ms', 'statuses'))
+    for r in results:
+        print('%-18s %-10s %-7s %9.0f %9.3f %9.3f  %s' % (
+            r['demo'], r['route'], r['identity'] or '-', r['rps'],
+            r['p50_ms'], r['p99_ms'],
+            ' '.join('%s:%s' % kv for kv in sorted(r['statuses'].items()))))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
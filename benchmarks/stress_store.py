@@ -0,0 +1,171 @@
+""" Hammer a page repository with concurrent readers and writers.
+
+Writer threads keep renaming a set of "rotating" pages the way
+``edit_page_view`` does, creating a new ``Page`` for every edit. Reader
+threads meanwhile check that what they see is consistent:
+
+- a listing of the rotating pages contains every one of them exactly
+  once, i.e. no page is missing or duplicated half way through a rename,
+- ``by_owner`` returns the right number of pages for an owner,
+- every page's uri, title and body belong to the same edit.
+
+Any violation is counted as a torn read and makes the script exit with
+status 1. The read and write rates are reported as well.
+
+``--unsafe-writes`` edits the shared page objects in place instead, as
+the demo used to, to show that the checks do catch torn reads.
+
+Usage::
+
+    python benchmarks/stress_store.py --readers 8 --writers 2 --seconds 5
+
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from demo_loader import load_demo  # noqa: E402
+
+def rotating(demo, k, n, owners):
+    title = 'rot%d v%d' % (k, n)
+    return demo.Page(
+        title, uri=demo.websafe_uri(title), body='body of ' + title,
+        owner='owner%d' % (k % owners))
+
+def is_torn(page):
+    return page.uri != page.title.replace(' ', '-') \
+        or page.body != 'body of ' + page.title
+
+class Counters(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.torn = {}
+
+    def add(self, reads=0, writes=0, torn=None):
+        with self.lock:
+            self.reads += reads
+            self.writes += writes
+            if torn is not None:
+                self.torn[torn] = self.torn.get(torn, 0) + 1
+
+def writer(demo, store, keys, args, stop, counters):
+    rng = random.Random(keys[0])
+    versions = dict.fromkeys(keys, 0)
+    writes = 0
+    while not stop.is_set():
+        k = rng.choice(keys)
+        old_uri = demo.websafe_uri('rot%d v%d' % (k, versions[k]))
+        versions[k] += 1
+        if args.unsafe_writes:
+            # what edit_page_view used to do
+            page = store.pages[old_uri]
+            page.title = 'rot%d v%d' % (k, versions[k])
+            page.body = 'body of ' + page.title
+            page.uri = demo.websafe_uri(page.title)
+        else:
+            page = rotating(demo, k, versions[k], args.owners)
+        store.pages.move(old_uri, page)
+        writes += 1
+    counters.add(writes=writes)
+
+def reader(store, args, stop, counters, seed):
+    rng = random.Random(seed)
+    per_owner = {}
+    for k in range(args.rotating):
+        owner = 'owner%d' % (k % args.owners)
+        per_owner[owner] = per_owner.get(owner, 0) + 1
+    reads = 0
+    while not stop.is_set():
+        if rng.random() < 0.5:
+            # the rotating pages sort between 'rot' and the static pages
+            pages = store.pages.listing('rot', args.rotating)
+            seen = {page.title.split()[0] for page in pages}
+            if len(seen) != args.rotating \
+                    or any(not p.uri.startswith('rot') for p in pages):
+                counters.add(torn='listing')
+        else:
+            owner = 'owner%d' % rng.randrange(args.owners)
+            pages = store.pages.by_owner(owner)
+            if len(pages) != per_owner[owner]:
+                counters.add(torn='by_owner')
+        for page in pages:
+            if is_torn(page):
+                counters.add(torn='page')
+                break
+        reads += 1
+    counters.add(reads=reads)
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--store', default='memory://')
+    parser.add_argument('--bodies', metavar='DIR',
+                        help='keep page bodies in a file in DIR')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--rotating', type=int, default=50,
+                        help='pages renamed by the writers')
+    parser.add_argument('--static', type=int, default=10000,
+                        help='pages which are never written')
+    parser.add_argument('--owners', type=int, default=5)
+    parser.add_argument('--switch-interval', type=float, default=1e-5,
+                        help='sys.setswitchinterval() while running, a '
+                             'short one makes threads interleave more')
+    parser.add_argument('--unsafe-writes', action='store_true')
+    args = parser.parse_args(argv[1:])
+
+    demo = load_demo('2.object_security')
+    store = demo.open_store(args.store, demo.User, demo.Page,
+                            body_dir=args.bodies)
+    store.pages.add_many(
+        demo.Page('static %d' % i, uri='static-%d' % i,
+                  body='body of static %d' % i, owner='static')
+        for i in range(args.static))
+    store.pages.add_many(
+        rotating(demo, k, 0, args.owners) for k in range(args.rotating))
+
+    stop = threading.Event()
+    counters = Counters()
+    threads = [
+        threading.Thread(target=writer, args=(
+            demo, store, list(range(i, args.rotating, args.writers)), args,
+            stop, counters))
+        for i in range(args.writers)
+    ] + [
+        threading.Thread(target=reader, args=(
+            store, args, stop, counters, i))
+        for i in range(args.readers)
+    ]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(args.switch_interval)
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    sys.setswitchinterval(switch_interval)
+    store.close()
+
+    print('%d readers, %d writers, %.1fs' % (
+        args.readers, args.writers, elapsed))
+    print('reads:  %10d  %10.0f/s' % (
+        counters.reads, counters.reads / elapsed))
+    print('writes: %10d  %10.0f/s' % (
+        counters.writes, counters.writes / elapsed))
+    torn = sum(counters.torn.values())
+    print('torn reads: %d %s' % (torn, counters.torn or ''))
+    return 1 if torn else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
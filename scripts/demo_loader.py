@@ -0,0 +1,79 @@
+""" Helpers for loading the demo applications from the command line tools.
+
+Each demo is a standalone ``demo.py`` next to a few helper modules with
+the same names as the other demos' helpers (``store.py`` and friends), so
+they cannot simply be imported side by side. ``load_demo`` imports a
+demo under a unique module name and then forgets its helpers so the next
+demo gets its own copies.
+"""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEMOS = (
+    '0.no_security',
+    '1.group_security',
+    '2.object_security',
+)
+
+def demo_path(name):
+    path = name if os.path.isabs(name) else os.path.join(ROOT, name)
+    if not os.path.isfile(os.path.join(path, 'demo.py')):
+        raise ValueError('%r does not contain a demo.py' % (name,))
+    return path
+
+def load_demo(name):
+    """ Import ``<name>/demo.py`` and return the module."""
+    path = demo_path(name)
+    modname = 'demo_' + os.path.basename(path).replace('.', '_')
+    module = sys.modules.get(modname)
+    if module is not None:
+        return module
+
+    helpers = [
+        fn[:-3] for fn in os.listdir(path)
+        if fn.endswith('.py') and fn != 'demo.py'
+    ]
+    sys.path.insert(0, path)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            modname, os.path.join(path, 'demo.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[modname] = module
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(path)
+        for helper in helpers:
+            sys.modules.pop(helper, None)
+    return module
+
+def demo_settings(name, **settings):
+    """ Return the settings ``demo.py`` uses when run directly."""
+    defaults = {
+        'auth.secret': 'seekrit',
+        'mako.directories': os.path.join(demo_path(name), 'templates'),
+    }
+    defaults.update(settings)
+    return defaults
+
+def template_cache_dir(name, base):
+    """ Return the Mako module directory for ``name`` below ``base``.
+
+    The demos have templates with the same names, so each one compiles
+    its templates into a directory of its own.
+    """
+    return os.path.join(base, os.path.basename(demo_path(name)))
+
+def template_cache_settings(name, base):
+    """ Return the settings which make ``name`` precompile its templates
+    into, or load them from, a module directory below ``base``."""
+    return {
+        'mako.module_directory': template_cache_dir(name, base),
+        'templates.precompile': 'true',
+    }
+
+def make_app(name, **settings):
+    module = load_demo(name)
+    return module.main({}, **demo_settings(name, **settings))
@@ -0,0 +1,212 @@
+""" Bulk import and export of users and pages as JSON Lines.
+
+Each line is a JSON object with a ``type`` of either ``"user"`` or
+``"page"``::
+
+    {"type": "user", "login": "luser", "password": "luser", "groups": []}
+    {"type": "page", "title": "hello", "body": "<p>hi</p>", "owner": "luser"}
+
+Both directions stream: export walks the pages in uri order one batch at
+a time and import inserts one batch at a time, so memory use does not
+grow with the size of the data set. Imported pages go through the demo's
+``validate_page`` and get their uri from ``websafe_uri``, exactly as if
+they had been created through the web form. In the demos which hash
+passwords, the imported passwords which are not hashes yet are hashed
+before they are stored (``--password-iterations``, as
+``auth.password.iterations``); hashes, e.g. from an export, are kept.
+
+``resanitize`` cleans again, in one pass, the bodies of the pages stored
+under an older sanitizer policy than the demo's, e.g. after the policy
+changed. Run it once for a store shared by several processes rather than
+having every process do it (``pages.sanitize.background``).
+
+Usage::
+
+    python scripts/pageio.py export --store sqlite:///demo.db > dump.jsonl
+    python scripts/pageio.py import --store sqlite:///demo.db < dump.jsonl
+    python scripts/pageio.py resanitize --store sqlite:///demo.db
+
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import sys
+import time
+
+from demo_loader import load_demo
+
+class Progress(object):
+    def __init__(self, label, every, stream=sys.stderr):
+        self.label = label
+        self.every = every
+        self.stream = stream
+        self.count = 0
+        self.skipped = 0
+        self.start = time.monotonic()
+        self._next = every
+
+    def add(self, n=1):
+        self.count += n
+        if self.every and self.count >= self._next:
+            self._next = self.count + self.every
+            self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        self.stream.write('%s%s: %d records (%d skipped) in %.1fs, %d/s\n' % (
+            'done ' if final else '', self.label, self.count, self.skipped,
+            elapsed, self.count / elapsed))
+        self.stream.flush()
+
+def export_data(demo, store, out, batch_size, progress):
+    for login, user in store.users.items():
+        out.write(json.dumps({
+            'type': 'user',
+            'login': user.login,
+            'password': user.password,
+            'groups': list(user.groups),
+        }) + '\n')
+        progress.add()
+
+    cursor = None
+    while True:
+        pages = store.pages.listing(cursor, batch_size)
+        if not pages:
+            break
+        for page in pages:
+            out.write(json.dumps({
+                'type': 'page',
+                'title': page.title,
+                'uri': page.uri,
+                'body': page.body,
+                'owner': page.owner,
+            }) + '\n')
+        progress.add(len(pages))
+        cursor = pages[-1].uri
+
+def hash_passwords(hasher, users):
+    plain = [user for user in users if not hasher.is_hash(user.password)]
+    if not plain:
+        return
+    # pbkdf2 releases the GIL, so a batch is hashed on all the cores
+    with concurrent.futures.ThreadPoolExecutor() as pool:
+        hashed = list(pool.map(hasher.hash, [u.password for u in plain]))
+    for user, password in zip(plain, hashed):
+        user.password = password
+
+def import_data(demo, store, lines, batch_size, progress,
+                password_iterations=200000):
+    users = []
+    pages = []
+    # validate_page sanitizes the bodies in the demos which have a policy
+    page_kw = {}
+    policy = getattr(demo, 'SANITIZER_POLICY', None)
+    if policy is not None:
+        page_kw['sanitized'] = policy.version
+    # the demos which hash passwords would otherwise keep the plaintext
+    # ones until each user next logs in
+    hasher = None
+    if hasattr(demo, 'PasswordHasher'):
+        hasher = demo.PasswordHasher(password_iterations, cache_size=0)
+
+    def flush():
+        if users:
+            if hasher is not None:
+                hash_passwords(hasher, users)
+            store.users.add_many(users)
+            progress.add(len(users))
+            del users[:]
+        if pages:
+            store.pages.add_many(pages)
+            progress.add(len(pages))
+            del pages[:]
+
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            kind = record['type']
+            if kind == 'user':
+                password = record['password']
+                if not isinstance(password, str):
+                    raise TypeError('password is not a string')
+                users.append(demo.User(
+                    record['login'],
+                    password=password,
+                    groups=list(record.get('groups') or []),
+                ))
+            elif kind == 'page':
+                v = demo.validate_page(record['title'], record['body'])
+                if v['errors']:
+                    raise ValueError('; '.join(v['errors']))
+                pages.append(demo.Page(
+                    v['title'],
+                    uri=demo.websafe_uri(v['title']),
+                    body=v['body'],
+                    owner=record['owner'],
+                    **page_kw
+                ))
+            else:
+                raise ValueError('unknown record type %r' % (kind,))
+        except (ValueError, KeyError, TypeError) as ex:
+            progress.skipped += 1
+            sys.stderr.write('line %d skipped: %s\n' % (lineno, ex))
+            continue
+
+        if len(users) + len(pages) >= batch_size:
+            flush()
+    flush()
+
+def resanitize_data(demo, store, batch_size, progress):
+    # only the rewritten pages are counted
+    resanitizer = demo.Resanitizer(
+        store, demo.Page, batch_size=batch_size, pause=0)
+    progress.add(resanitizer.run())
+
+def open_file(path, mode, stdio):
+    if path == '-':
+        return contextlib.nullcontext(stdio)
+    return open(path, mode, encoding='utf-8')
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('command', choices=['import', 'export', 'resanitize'])
+    parser.add_argument('--demo', default='2.object_security',
+                        help='demo directory whose model to use')
+    parser.add_argument('--store', required=True,
+                        help='store url, e.g. sqlite:///demo.db')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--progress-every', type=int, default=100000,
+                        help='report progress every N records (0 disables)')
+    parser.add_argument('--file', default='-',
+                        help='file to read from or write to (default: stdio)')
+    parser.add_argument('--password-iterations', type=int, default=200000,
+                        help='pbkdf2 iterations for the imported passwords '
+                             'which are not hashed yet')
+    args = parser.parse_args(argv[1:])
+
+    demo = load_demo(args.demo)
+    if args.command == 'resanitize' and not hasattr(demo, 'Resanitizer'):
+        parser.error('%s does not sanitize page bodies' % args.demo)
+    store = demo.open_store(args.store, demo.User, demo.Page)
+    progress = Progress(args.command, args.progress_every)
+    try:
+        if args.command == 'export':
+            with open_file(args.file, 'w', sys.stdout) as out:
+                export_data(demo, store, out, args.batch_size, progress)
+        elif args.command == 'resanitize':
+            resanitize_data(demo, store, args.batch_size, progress)
+        else:
+            with open_file(args.file, 'r', sys.stdin) as lines:
+                import_data(demo, store, lines, args.batch_size, progress,
+                            args.password_iterations)
+    finally:
+        store.close()
+    progress.report(final=True)
+    return 0 if not progress.skipped else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,42 @@
+""" Compile the demos' Mako templates into a module directory.
+
+Run this once per deploy. Afterwards, processes started with the same
+directory load the compiled modules and do not compile any templates::
+
+    python scripts/precompile_templates.py --module-directory /tmp/mako
+    python scripts/prefork.py --workers 4 --store sqlite:///demo.db \\
+        --template-cache /tmp/mako
+
+Every demo gets a subdirectory of its own below ``--module-directory``.
+A template is compiled again whenever its source is newer than the
+compiled module.
+"""
+import argparse
+import sys
+import time
+
+from demo_loader import DEMOS
+from demo_loader import load_demo
+from demo_loader import make_app
+from demo_loader import template_cache_dir
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--demo', action='append',
+                        help='demo to compile, may be repeated (default: all)')
+    parser.add_argument('--module-directory', required=True)
+    args = parser.parse_args(argv[1:])
+
+    for demo in args.demo or DEMOS:
+        module_directory = template_cache_dir(demo, args.module_directory)
+        app = make_app(demo, **{'mako.module_directory': module_directory})
+        start = time.perf_counter()
+        names = load_demo(demo).precompile_templates(app.registry)
+        elapsed = time.perf_counter() - start
+        print('%s: %d templates in %.1fms -> %s' % (
+            demo, len(names), elapsed * 1000, module_directory))
+        app.registry.store.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
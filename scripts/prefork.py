@@ -0,0 +1,246 @@
+""" Serve a demo from several pre-forked worker processes.
+
+The master process binds the listening socket and forks ``--workers``
+children which all accept connections from it. The master never imports
+the demo itself; each worker builds the app with ``main()`` after the
+fork, so every worker opens its own connections to the store and a
+reload picks up code changes.
+
+Because each worker is a separate process the in-memory store would give
+every worker its own diverging copy of the data, so more than one worker
+requires a shared store such as ``--store sqlite:///demo.db``.
+
+A worker which exits unexpectedly is replaced. When workers keep exiting
+within ``--min-uptime`` seconds of starting, e.g. because the demo fails
+to start, each replacement waits twice as long as the previous one, and
+after ``--max-quick-failures`` such exits in a row the master stops with
+exit status 1.
+
+Signals understood by the master:
+
+- ``HUP`` starts a new set of workers, then asks the old ones to finish
+  their current request and exit.
+- ``TERM`` / ``INT`` stop all workers gracefully and exit.
+
+Usage::
+
+    python scripts/prefork.py --workers 4 --store sqlite:///demo.db
+
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from wsgiref.simple_server import WSGIRequestHandler
+from wsgiref.simple_server import WSGIServer
+
+from demo_loader import make_app
+from demo_loader import template_cache_settings
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class SharedSocketWSGIServer(WSGIServer):
+    """ A ``wsgiref`` server accepting from an already bound socket."""
+    def __init__(self, sock, handler=WSGIRequestHandler):
+        WSGIServer.__init__(
+            self, sock.getsockname()[:2], handler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        host, port = sock.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+        # every worker is woken up for a new connection but only one of
+        # them gets it, the others must not block in accept()
+        self.socket.setblocking(False)
+
+    def get_request(self):
+        conn, addr = self.socket.accept()
+        conn.setblocking(True)
+        return conn, addr
+
+def run_worker(sock, args):
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(1))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    settings = {'store.url': args.store}
+    if args.template_cache:
+        settings.update(
+            template_cache_settings(args.demo, args.template_cache))
+    app = make_app(args.demo, **settings)
+    handler = QuietHandler if args.quiet else WSGIRequestHandler
+    server = SharedSocketWSGIServer(sock, handler)
+    server.set_app(app)
+    server.timeout = 0.5
+    while not stopping:
+        server.handle_request()
+    app.registry.store.close()
+
+def spawn(sock, args):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(sock, args)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+class Master(object):
+    # seconds before replacing a worker after the first quick failure
+    first_backoff = 0.5
+    max_backoff = 30.0
+
+    def __init__(self, sock, args):
+        self.sock = sock
+        self.args = args
+        self.workers = set()
+        self.retiring = set()
+        self.started = {}
+        # times at which to replace workers which exited
+        self.restarts = []
+        self.quick_failures = 0
+        self.reload_requested = False
+        self.stopping = False
+        self.exit_code = 0
+
+    def spawn_worker(self):
+        pid = spawn(self.sock, self.args)
+        self.started[pid] = time.monotonic()
+        return pid
+
+    def start_workers(self):
+        return {self.spawn_worker() for i in range(self.args.workers)}
+
+    def signal_workers(self, pids, signum):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.started.pop(pid, None)
+            self.retiring.discard(pid)
+            if pid in self.workers:
+                self.workers.discard(pid)
+                if not self.stopping:
+                    self.worker_failed(pid, time.monotonic() - started)
+
+    def worker_failed(self, pid, uptime):
+        if uptime >= self.args.min_uptime:
+            self.quick_failures = 0
+            delay = 0
+        else:
+            self.quick_failures += 1
+            if self.quick_failures >= self.args.max_quick_failures:
+                sys.stderr.write(
+                    'worker %d exited after %.1fs, %d workers in a row '
+                    'failed to stay up, giving up\n' % (
+                        pid, uptime, self.quick_failures))
+                self.stopping = True
+                self.exit_code = 1
+                return
+            delay = min(
+                self.first_backoff * 2 ** (self.quick_failures - 1),
+                self.max_backoff)
+        sys.stderr.write('worker %d exited unexpectedly, restarting in '
+                         '%.1fs\n' % (pid, delay))
+        self.restarts.append(time.monotonic() + delay)
+
+    def restart_workers(self):
+        now = time.monotonic()
+        due = [when for when in self.restarts if when <= now]
+        if due:
+            self.restarts = [when for when in self.restarts if when > now]
+            self.workers |= {self.spawn_worker() for when in due}
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self.on_reload)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+
+        self.workers = self.start_workers()
+        sys.stderr.write('master %d serving on %s with %d workers\n' % (
+            os.getpid(), self.sock.getsockname(), self.args.workers))
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                # the new workers replace those waiting to be restarted
+                self.restarts = []
+                self.quick_failures = 0
+                old, self.workers = self.workers, self.start_workers()
+                self.retiring |= old
+                self.signal_workers(old, signal.SIGTERM)
+                sys.stderr.write('reloaded workers\n')
+            self.reap()
+            if not self.stopping:
+                self.restart_workers()
+            time.sleep(0.2)
+
+        self.signal_workers(self.workers | self.retiring, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout
+        while (self.workers or self.retiring) \
+                and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.signal_workers(self.workers | self.retiring, signal.SIGKILL)
+        self.reap()
+        return self.exit_code
+
+    def on_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def on_stop(self, signum, frame):
+        self.stopping = True
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--demo', default='2.object_security')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--store', default='memory://')
+    parser.add_argument('--template-cache', metavar='DIR',
+                        help='load and write compiled templates below DIR')
+    parser.add_argument('--backlog', type=int, default=1024)
+    parser.add_argument('--graceful-timeout', type=float, default=30.0)
+    parser.add_argument('--min-uptime', type=float, default=5.0,
+                        help='workers exiting sooner count as failing')
+    parser.add_argument('--max-quick-failures', type=int, default=5,
+                        help='stop after N workers in a row failed')
+    parser.add_argument('--quiet', action='store_true',
+                        help='do not log every request')
+    args = parser.parse_args(argv[1:])
+
+    if args.workers > 1 and args.store == 'memory://':
+        parser.error('memory:// would give every worker its own copy of '
+                     'the data, use a shared store such as sqlite:///demo.db')
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+
+    return Master(sock, args).run()
+
+if __name__ == '__main__':
+    sys.exit(main())
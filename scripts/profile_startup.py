@@ -0,0 +1,173 @@
+""" Report where a demo spends its startup time.
+
+Every run starts a fresh Python process, imports the demo and calls its
+``main()``, so imports are as cold as after a restart. Time is charged to
+the innermost phase being executed:
+
+imports
+    Importing Pyramid and the demo module with its helpers.
+store
+    Opening the store.
+demo data
+    Seeding the demo users and pages, including hashing their passwords.
+search index
+    Building the search index from the store.
+scan
+    ``config.scan`` and the venusian callbacks it runs.
+views
+    ``config.add_view`` and friends called directly (``views.scan=false``).
+routes
+    ``config.add_route``.
+templates
+    Including pyramid_mako and precompiling templates.
+commit
+    Executing the configuration actions and creating the WSGI app.
+other
+    The remainder of ``main()``.
+
+With ``--budget`` the script exits with status 1 when the median total
+exceeds the given number of milliseconds, so it can guard deploys::
+
+    python scripts/profile_startup.py --setting views.scan=false \\
+        --budget 500
+
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PHASES = (
+    'imports', 'store', 'demo data', 'search index', 'scan', 'views',
+    'routes', 'templates', 'commit', 'other',
+)
+
+# functions main() looks up in the demo module's globals
+MODULE_PHASES = {
+    'open_store': 'store',
+    '_init_demo_data': 'demo data',
+    'build_index': 'search index',
+    'precompile_templates': 'templates',
+}
+
+CONFIGURATOR_PHASES = {
+    'scan': 'scan',
+    'add_view': 'views',
+    'add_forbidden_view': 'views',
+    'add_subscriber': 'views',
+    'add_route': 'routes',
+    'make_wsgi_app': 'commit',
+}
+
+class PhaseTimer(object):
+    """ Charge elapsed time to the innermost running phase."""
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self._stack = []
+        self.totals = dict.fromkeys(PHASES, 0.0)
+
+    def start(self, phase):
+        self._stack.append([phase, self._clock(), 0.0])
+
+    def stop(self):
+        phase, started, children = self._stack.pop()
+        elapsed = self._clock() - started
+        self.totals[phase] += elapsed - children
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def wrap(self, phase, fn):
+        def wrapper(*args, **kw):
+            name = phase(*args) if callable(phase) else phase
+            self.start(name)
+            try:
+                return fn(*args, **kw)
+            finally:
+                self.stop()
+        return wrapper
+
+def include_phase(config, target, *args):
+    return 'templates' if target == 'pyramid_mako' else 'other'
+
+def profile(demo, settings):
+    timer = PhaseTimer()
+    timer.start('imports')
+    from pyramid.config import Configurator
+    from demo_loader import demo_settings
+    from demo_loader import load_demo
+    module = load_demo(demo)
+    timer.stop()
+
+    for name, phase in CONFIGURATOR_PHASES.items():
+        setattr(Configurator, name,
+                timer.wrap(phase, getattr(Configurator, name)))
+    Configurator.include = timer.wrap(include_phase, Configurator.include)
+    for name, phase in MODULE_PHASES.items():
+        fn = getattr(module, name, None)
+        if fn is not None:
+            setattr(module, name, timer.wrap(phase, fn))
+
+    timer.start('other')
+    app = module.main({}, **demo_settings(demo, **settings))
+    timer.stop()
+    app.registry.store.close()
+    return timer.totals
+
+def run_child(demo, settings):
+    """ Profile a startup in a new interpreter and return its totals."""
+    cmd = [sys.executable, os.path.abspath(__file__), '--child',
+           '--demo', demo]
+    for key, value in settings.items():
+        cmd += ['--setting', '%s=%s' % (key, value)]
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out)
+
+def parse_setting(value):
+    key, sep, value = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('expected key=value')
+    return key, value
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--demo', default='2.object_security')
+    parser.add_argument('--store', default='memory://')
+    parser.add_argument('--setting', type=parse_setting, action='append',
+                        default=[], metavar='KEY=VALUE',
+                        help='extra setting passed to main(), may be repeated')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, metavar='MS',
+                        help='fail if the median total exceeds MS')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv[1:])
+    settings = dict(args.setting)
+
+    if args.child:
+        json.dump(profile(args.demo, settings), sys.stdout)
+        return 0
+
+    settings.setdefault('store.url', args.store)
+    runs = [run_child(args.demo, settings) for i in range(args.runs)]
+    totals = [sum(run.values()) for run in runs]
+
+    print('%s, median of %d runs' % (args.demo, args.runs))
+    print('%-14s %10s %10s' % ('phase', 'median ms', 'max ms'))
+    for phase in PHASES:
+        values = [run[phase] * 1000 for run in runs]
+        print('%-14s %10.1f %10.1f' % (
+            phase, statistics.median(values), max(values)))
+    median = statistics.median(totals) * 1000
+    print('%-14s %10.1f %10.1f' % ('total', median, max(totals) * 1000))
+
+    if args.budget is not None and median > args.budget:
+        print('startup took %.1fms, over the budget of %.1fms' % (
+            median, args.budget))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
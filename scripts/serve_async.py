@@ -0,0 +1,303 @@
+""" Serve a demo with an asyncio HTTP/1.1 server.
+
+``python demo.py`` uses ``wsgiref`` which handles one request at a time.
+This server accepts connections with asyncio, keeps them alive between
+requests and runs the demo's WSGI application on a bounded thread pool,
+so a slow client only ties up its own connection. A client must send
+the rest of a request's head, and then its body, within
+``--read-timeout`` seconds each, or its connection is closed.
+
+Usage::
+
+    python scripts/serve_async.py --demo 2.object_security --threads 8
+
+Pass ``--store sqlite:///demo.db`` when the data should survive restarts.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import io
+import sys
+import traceback
+import urllib.parse
+
+from demo_loader import make_app
+from demo_loader import template_cache_settings
+
+MAX_HEADER_LINES = 100
+MAX_BODY = 10 * 1024 * 1024
+
+class BadRequest(Exception):
+    pass
+
+def build_environ(method, target, version, headers, body, server, peer):
+    path, _, query = target.partition('?')
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': urllib.parse.unquote_to_bytes(path).decode('latin-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': version,
+        'REMOTE_ADDR': peer[0] if peer else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers:
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif key == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + key
+            if key in environ:
+                value = environ[key] + ',' + value
+            environ[key] = value
+    return environ
+
+def start_app(app, environ):
+    """ Call the application in a worker thread.
+
+    Returns the status, the headers and an iterator over the body. The
+    first chunk is fetched here as well because many applications only
+    call ``start_response`` once iteration has begun.
+    """
+    state = {}
+    written = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info is not None and state.get('sent'):
+            raise exc_info[1].with_traceback(exc_info[2])
+        state['status'] = status
+        state['headers'] = headers
+        return written.append
+
+    result = app(environ, start_response)
+    chunks = iter(result)
+    first = next(chunks, None)
+    state['sent'] = True
+    prefix = written + ([first] if first is not None else [])
+    return state['status'], state['headers'], prefix, chunks, result
+
+def next_chunk(chunks):
+    return next(chunks, None)
+
+class AsyncWSGIServer(object):
+    def __init__(self, app, host, port, threads, max_connections,
+                 keepalive_timeout, read_timeout=30.0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='wsgi')
+        self.connections = asyncio.Semaphore(max_connections)
+        self.keepalive_timeout = keepalive_timeout
+        self.read_timeout = read_timeout
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port)
+        addrs = ', '.join(str(s.getsockname()) for s in server.sockets)
+        sys.stderr.write('serving on %s\n' % addrs)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        async with self.connections:
+            try:
+                while await self.handle_request(reader, writer):
+                    pass
+            except (asyncio.TimeoutError, ConnectionError,
+                    asyncio.IncompleteReadError):
+                pass
+            except BadRequest as ex:
+                msg = str(ex).encode('utf-8')
+                writer.write(
+                    b'HTTP/1.1 400 Bad Request\r\nConnection: close\r\n'
+                    b'Content-Length: %d\r\n\r\n%s' % (len(msg), msg))
+            finally:
+                writer.close()
+
+    async def read_head(self, reader):
+        line = await asyncio.wait_for(
+            reader.readline(), self.keepalive_timeout)
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise BadRequest('malformed request line')
+
+        # the deadline covers all the headers so they cannot trickle in
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.read_timeout
+        headers = []
+        for i in range(MAX_HEADER_LINES):
+            line = await asyncio.wait_for(
+                reader.readline(), deadline - loop.time())
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, sep, value = line.decode('latin-1').partition(':')
+            if not sep:
+                raise BadRequest('malformed header')
+            headers.append((name.strip(), value.strip()))
+        else:
+            raise BadRequest('too many headers')
+        return method, target, version, headers
+
+    async def handle_request(self, reader, writer):
+        head = await self.read_head(reader)
+        if head is None:
+            return False
+        method, target, version, headers = head
+        lowered = {name.lower(): value for name, value in headers}
+
+        if 'chunked' in lowered.get('transfer-encoding', '').lower():
+            raise BadRequest('chunked request bodies are not supported')
+        try:
+            length = int(lowered.get('content-length', 0))
+        except ValueError:
+            raise BadRequest('invalid content-length')
+        if length < 0 or length > MAX_BODY:
+            raise BadRequest('request body too large')
+        body = b''
+        if length:
+            expect = lowered.get('expect', '').lower()
+            if version == 'HTTP/1.1' and expect == '100-continue':
+                writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                await writer.drain()
+            body = await asyncio.wait_for(
+                reader.readexactly(length), self.read_timeout)
+
+        connection = lowered.get('connection', '').lower()
+        keep_alive = (
+            version == 'HTTP/1.1' and connection != 'close'
+            or version == 'HTTP/1.0' and connection == 'keep-alive'
+        )
+
+        environ = build_environ(
+            method, target, version, headers, body,
+            writer.get_extra_info('sockname') or (self.host, self.port),
+            writer.get_extra_info('peername'))
+
+        loop = asyncio.get_running_loop()
+        try:
+            status, app_headers, prefix, chunks, result = \
+                await loop.run_in_executor(
+                    self.pool, start_app, self.app, environ)
+        except Exception:
+            traceback.print_exc()
+            writer.write(
+                b'HTTP/1.1 500 Internal Server Error\r\n'
+                b'Connection: close\r\nContent-Length: 0\r\n\r\n')
+            await writer.drain()
+            return False
+        try:
+            return await self.send_response(
+                writer, method, version, keep_alive, status, app_headers,
+                prefix, chunks)
+        except ConnectionError:
+            raise
+        except Exception:
+            # the head may be out already, so the connection can only be
+            # closed to tell the client the response is incomplete
+            traceback.print_exc()
+            return False
+        finally:
+            close = getattr(result, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(self.pool, close)
+
+    async def send_response(self, writer, method, version, keep_alive,
+                            status, app_headers, prefix, chunks):
+        loop = asyncio.get_running_loop()
+        names = {name.lower() for name, value in app_headers}
+        chunked = False
+        out_headers = list(app_headers)
+        # 1xx, 204 and 304 responses and responses to HEAD have no body
+        # and must not be framed as if they had one
+        code = int(status.split(None, 1)[0])
+        has_body = method != 'HEAD' and code >= 200 \
+            and code not in (204, 304)
+        if has_body and 'content-length' not in names:
+            if version == 'HTTP/1.1':
+                chunked = True
+                out_headers.append(('Transfer-Encoding', 'chunked'))
+            else:
+                keep_alive = False
+        out_headers.append(
+            ('Connection', 'keep-alive' if keep_alive else 'close'))
+
+        head = ['HTTP/1.1 %s\r\n' % status]
+        head.extend('%s: %s\r\n' % header for header in out_headers)
+        head.append('\r\n')
+        writer.write(''.join(head).encode('latin-1'))
+
+        if not has_body:
+            # whatever the application would have sent is dropped
+            await writer.drain()
+            return keep_alive
+
+        def send(data):
+            if not data:
+                return
+            if chunked:
+                writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+            else:
+                writer.write(data)
+
+        for data in prefix:
+            send(data)
+        await writer.drain()
+        while True:
+            data = await loop.run_in_executor(
+                self.pool, next_chunk, chunks)
+            if data is None:
+                break
+            send(data)
+            await writer.drain()
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return keep_alive
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--demo', default='2.object_security')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8,
+                        help='size of the thread pool running the app')
+    parser.add_argument('--max-connections', type=int, default=1000,
+                        help='connections served at once, others wait')
+    parser.add_argument('--keepalive-timeout', type=float, default=15.0)
+    parser.add_argument('--read-timeout', type=float, default=30.0,
+                        help='seconds allowed for the headers and the body')
+    parser.add_argument('--store', default='memory://')
+    parser.add_argument('--template-cache', metavar='DIR',
+                        help='load and write compiled templates below DIR')
+    args = parser.parse_args(argv[1:])
+
+    settings = {'store.url': args.store}
+    if args.template_cache:
+        settings.update(
+            template_cache_settings(args.demo, args.template_cache))
+    app = make_app(args.demo, **settings)
+    server = AsyncWSGIServer(
+        app, args.host, args.port, args.threads, args.max_connections,
+        args.keepalive_timeout, args.read_timeout)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())